@@ -1,12 +1,23 @@
+import gc
+import json
 import os
-from typing import Any, Dict, List
+import signal
+import socket
+import sys
+import time
+from logging import getLogger
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, model_validator
 
-from .encoder import Retriever
+from .retriever import Retriever
+
+logger = getLogger(__name__)
 
 is_dev = (
     os.environ.get("FOTLA_ENV", "dev") == "dev"
@@ -14,10 +25,15 @@ is_dev = (
 )
 
 
-def start_api(retriever: Retriever, host: str = "0.0.0.0", port: int = 8000) -> None:
+def start_api(
+    retriever: Retriever, host: str = "0.0.0.0", port: int = 8000, workers: int = 1
+) -> None:
     app = load_fastapi_app(retriever)
 
-    uvicorn.run(app, host=host, port=port)
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+    else:
+        start_forked_workers(app, retriever, host=host, port=port, workers=workers)
 
 
 def load_fastapi_app(retriever: Retriever) -> FastAPI:
@@ -26,6 +42,174 @@ def load_fastapi_app(retriever: Retriever) -> FastAPI:
     return app
 
 
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Binds the listening socket shared by all the workers.
+
+    Args:
+        host: The host to bind.
+        port: The port to bind.
+
+    Returns:
+        The bound socket.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def check_fork_safety() -> None:
+    """Raises if the parent process already owns a CUDA context.
+
+    A CUDA context can not be shared with forked children, so fork-after-load
+    serving only works for models loaded on the CPU.
+    """
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_initialized():
+        raise RuntimeError(
+            "CUDA is initialized in the parent process. "
+            "Load the model on cpu to serve with multiple workers."
+        )
+
+
+def run_worker(
+    app: FastAPI,
+    retriever: Retriever,
+    sock: socket.socket,
+    host: str,
+    port: int,
+    threads: int,
+) -> None:
+    retriever.after_fork()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+    config = uvicorn.Config(app, host=host, port=port)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def fork_worker(
+    app: FastAPI,
+    retriever: Retriever,
+    sock: socket.socket,
+    host: str,
+    port: int,
+    threads: int,
+) -> int:
+    """Forks a worker process serving the app on the socket.
+
+    The worker always ends with `os._exit`, so that it never returns into the
+    code of the parent (its main function, atexit handlers and so on).
+
+    Returns:
+        The pid of the worker.
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    exit_code = 1
+    try:
+        run_worker(app, retriever, sock, host, port, threads)
+        exit_code = 0
+    except BaseException:
+        logger.exception("worker failed.")
+    finally:
+        os._exit(exit_code)
+
+
+def start_forked_workers(
+    app: FastAPI,
+    retriever: Retriever,
+    host: str,
+    port: int,
+    workers: int,
+    min_uptime: float = 10.0,
+) -> None:
+    """Serves the app with multiple worker processes forked after model loading.
+
+    The retriever (and the model weights it holds) is loaded once in the parent
+    and then inherited by each worker through copy-on-write pages, so the memory
+    usage stays nearly flat as the number of workers grows. Each worker calls
+    `retriever.after_fork()` so that connections such as the Elasticsearch
+    client are not shared between processes.
+
+    A worker that crashes is replaced by a new one. If it crashes within
+    `min_uptime` seconds of being started, it would most likely crash again, so
+    all the workers are stopped instead and RuntimeError is raised.
+
+    Args:
+        app: The app to serve.
+        retriever: The retriever served by the app.
+        host: The host to bind.
+        port: The port to bind.
+        workers: The number of worker processes.
+        min_uptime: The seconds a worker must run before it is restarted on a
+            crash.
+    """
+    check_fork_safety()
+
+    sock = bind_socket(host, port)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    # Move every object loaded so far into the permanent generation so that the
+    # cyclic gc of the workers does not touch (and copy) the shared pages.
+    gc.collect()
+    gc.freeze()
+
+    started: Dict[int, float] = {}
+    for i in range(workers):
+        pid = fork_worker(app, retriever, sock, host, port, threads_per_worker)
+        logger.info(f"started worker {i} (pid: {pid})")
+        started[pid] = time.monotonic()
+
+    stopping: List[int] = []
+
+    def terminate_workers(signum, frame) -> None:
+        stopping.append(signum)
+        for pid in list(started):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, terminate_workers)
+    signal.signal(signal.SIGTERM, terminate_workers)
+
+    failed = False
+    while len(started) > 0:
+        pid, status = os.wait()
+        if pid not in started:
+            continue
+        uptime = time.monotonic() - started.pop(pid)
+        if os.WIFEXITED(status):
+            exit_code = os.WEXITSTATUS(status)
+        else:
+            exit_code = -os.WTERMSIG(status)
+        if exit_code == 0 or len(stopping) > 0:
+            logger.info(f"worker (pid: {pid}) exited with code {exit_code}.")
+            continue
+
+        logger.error(f"worker (pid: {pid}) exited with code {exit_code}.")
+        if uptime < min_uptime:
+            logger.error(f"worker crashed within {min_uptime} sec, stopping.")
+            failed = True
+            terminate_workers(signal.SIGTERM, None)
+            continue
+
+        pid = fork_worker(app, retriever, sock, host, port, threads_per_worker)
+        logger.info(f"restarted worker (pid: {pid})")
+        started[pid] = time.monotonic()
+    sock.close()
+
+    if failed:
+        raise RuntimeError("workers crashed on startup.")
+
+
 def setup_api_endpoint(app: FastAPI, retriever: Retriever) -> None:
     class SearchRequest(BaseModel):
         query: str
@@ -34,15 +218,72 @@ def setup_api_endpoint(app: FastAPI, retriever: Retriever) -> None:
         size: int = 10
         hybrid: bool = True
         search_fields: List[str] = ["subject_number", "subject_number", "overview"]
+        source: Optional[List[str]] = None
+        source_excludes: Optional[List[str]] = None
+        highlight_fields: Optional[List[str]] = None
+        highlight_only: bool = False
+
+        @model_validator(mode="after")
+        def check_highlight(self) -> "SearchRequest":
+            if self.highlight_only and not self.highlight_fields:
+                raise ValueError("highlight_only requires highlight_fields.")
+            return self
+
+    class BatchSearchRequest(SearchRequest):
+        query: str = ""
+        queries: List[str] = []
+
+        @model_validator(mode="after")
+        def check_queries(self) -> "BatchSearchRequest":
+            if len(self.queries) <= 0 and self.query == "":
+                raise ValueError("Either query or queries must be given.")
+            return self
+
+    def retrieve(queries: List[str], request: SearchRequest) -> List:
+        """Retrieves, turning the errors caused by the request into 400."""
+        try:
+            return retriever.retrieve(
+                queries,
+                top_k=request.topk,
+                from_=request.from_,
+                size=request.size,
+                hybrid=request.hybrid,
+                search_fields=request.search_fields,
+                source=request.source,
+                source_excludes=request.source_excludes,
+                highlight_fields=request.highlight_fields,
+                highlight_only=request.highlight_only,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
     @app.post("/search")
     async def search(request: SearchRequest) -> Dict[str, Any]:
-        result = retriever.retrieve(
-            [request.query],
-            top_k=request.topk,
-            from_=request.from_,
-            size=request.size,
-            hybrid=request.hybrid,
-            search_fields=request.search_fields,
-        )
+        result = retrieve([request.query], request)
         return {"status": "success", "result": result}
+
+    @app.post("/search/stream")
+    def search_stream(request: BatchSearchRequest) -> StreamingResponse:
+        """Streams the results as NDJSON.
+
+        For each query a header line `{"query", "total"}` is written, followed by
+        one line per hit, so that deep result pages and batches of queries are
+        serialized incrementally instead of as one big response body.
+        """
+        queries = request.queries if request.queries else [request.query]
+
+        # the first query is retrieved before the response starts, so that an
+        # invalid request is answered with 400 instead of a broken stream
+        first = retrieve(queries[:1], request)
+        rest = (
+            result for query in queries[1:] for result in retrieve([query], request)
+        )
+
+        def iter_lines() -> Iterator[str]:
+            for query, result in chain(first, rest):
+                header = {"query": query, "total": result["total"]}
+                yield json.dumps(header) + "\n"
+                for hit in result["hits"]:
+                    yield json.dumps({"query": query, "hit": hit}) + "\n"
+
+        return StreamingResponse(iter_lines(), media_type="application/x-ndjson")
@@ -0,0 +1,71 @@
+from logging import getLogger
+from typing import List, Optional, Tuple
+
+from transformers import PreTrainedTokenizerBase
+
+logger = getLogger(__name__)
+
+
+class PassageChunker(object):
+    """Splits texts into overlapping windows of at most `max_tokens` tokens.
+
+    The windows are cut on the character offsets of the tokens, so the passages
+    are substrings of the original text. A fast tokenizer is required.
+    """
+
+    def __init__(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        max_tokens: Optional[int] = None,
+        overlap: int = 64,
+    ) -> None:
+        if not tokenizer.is_fast:
+            raise ValueError("PassageChunker requires a fast tokenizer.")
+
+        if max_tokens is None:
+            max_length = min(tokenizer.model_max_length, 512)
+            max_tokens = max_length - tokenizer.num_special_tokens_to_add()
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("overlap must be in [0, max_tokens).")
+
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def chunk_offsets(
+        self, offsets: List[Tuple[int, int]], text_length: int
+    ) -> List[Tuple[int, int]]:
+        if len(offsets) <= self.max_tokens:
+            return [(0, text_length)]
+
+        spans = []
+        step = self.max_tokens - self.overlap
+        for start in range(0, len(offsets), step):
+            end = min(start + self.max_tokens, len(offsets))
+            spans.append((offsets[start][0], offsets[end - 1][1]))
+            if end >= len(offsets):
+                break
+        return spans
+
+    def chunk(self, texts: List[str]) -> Tuple[List[str], List[int]]:
+        """Splits the texts into passages.
+
+        Args:
+            texts: The texts to split.
+
+        Returns:
+            The passages and the index of the text each passage comes from.
+        """
+        encodings = self.tokenizer(
+            texts, add_special_tokens=False, return_offsets_mapping=True
+        )
+
+        passages: List[str] = []
+        parents: List[int] = []
+        for i, (text, offsets) in enumerate(
+            zip(texts, encodings["offset_mapping"])
+        ):
+            for start, end in self.chunk_offsets(offsets, len(text)):
+                passages.append(text[start:end])
+                parents.append(i)
+        return passages, parents
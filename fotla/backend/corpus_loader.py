@@ -1,6 +1,10 @@
 import abc
+import glob
 import json
-from typing import Dict, Iterator, List, Optional
+import os
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 from more_itertools import chunked
 from pydantic import BaseModel
@@ -16,15 +20,64 @@ class Doc(BaseModel):
     title: str = ""
 
 
+@dataclass
+class DocBatch:
+    """A batch of documents held as columns instead of one model per row."""
+
+    columns: Dict[str, List[Any]]
+
+    def __len__(self) -> int:
+        return len(self.columns["doc_id"])
+
+    def column(self, name: str, default: Any = None) -> List[Any]:
+        if name in self.columns:
+            return self.columns[name]
+        return [default] * len(self)
+
+    @property
+    def doc_ids(self) -> List[str]:
+        return self.columns["doc_id"]
+
+    @property
+    def texts(self) -> List[str]:
+        return self.column("text", "")
+
+    @property
+    def titles(self) -> List[str]:
+        return self.column("title", "")
+
+    def to_docs(self) -> List[Doc]:
+        return [
+            Doc(doc_id=doc_id, text=text, title=title)
+            for doc_id, text, title in zip(self.doc_ids, self.texts, self.titles)
+        ]
+
+    @classmethod
+    def from_docs(cls, docs: List[BaseModel]) -> "DocBatch":
+        columns: Dict[str, List[Any]] = {}
+        for doc in docs:
+            for key, value in doc.model_dump().items():
+                columns.setdefault(key, []).append(value)
+        return cls(columns)
+
+
 class Preprocessor(object):
     def __call__(self, doc: BaseModel) -> BaseModel:
         raise NotImplementedError
 
 
 class CorpusLoader(abc.ABC):
+    # True if the loader produces DocBatch natively, so that indexing should go
+    # through `load_batches` rather than per-row models.
+    columnar: bool = False
+
     def load(self, batch_size: int = 10_000) -> Iterator[List[BaseModel]]:
         raise NotImplementedError
 
+    def load_batches(self, batch_size: int = 10_000) -> Iterator[DocBatch]:
+        for docs in self.load(batch_size=batch_size):
+            yield DocBatch.from_docs(docs)
+
 
 class JsonlCorpusLoader(CorpusLoader):
     def __init__(
@@ -67,3 +120,98 @@ class AdhocCorpusLoader(CorpusLoader):
     def load(self, batch_size: int = 10_000) -> Iterator[List[BaseModel]]:
         for chunk in chunked(self.docs, batch_size):
             yield self.dict_to_doc(chunk)
+
+
+class ParquetCorpusLoader(CorpusLoader):
+    """Streams a (multi-file) Parquet dataset as columnar record batches.
+
+    Only the projected columns are read, and no model is created per row. The
+    columns are converted to Python lists, which copies the values out of the
+    Arrow buffers. Missing titles and texts are read as empty strings. The row
+    groups of all the files are split round-robin across `num_workers`, so that
+    each worker loads a disjoint part of the corpus.
+    """
+
+    columnar = True
+
+    def __init__(
+        self,
+        path: Union[str, List[str]],
+        columns: List[str] = ["doc_id", "title", "text"],
+        worker_id: int = 0,
+        num_workers: int = 1,
+        verbose: bool = True,
+    ) -> None:
+        if not 0 <= worker_id < num_workers:
+            raise ValueError("worker_id must be in [0, num_workers).")
+
+        self.path = path
+        self.columns = columns
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.verbose = verbose
+
+    def list_files(self) -> List[str]:
+        paths = [self.path] if isinstance(self.path, str) else self.path
+        files: List[str] = []
+        for path in paths:
+            if os.path.isdir(path):
+                pattern = os.path.join(path, "**/*.parquet")
+                files.extend(glob.glob(pattern, recursive=True))
+            else:
+                files.extend(glob.glob(path))
+        return sorted(files)
+
+    def assigned_row_groups(self) -> List[Tuple[str, int]]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required for ParquetCorpusLoader. "
+                "Install it with `pip install fotla[parquet]`."
+            )
+
+        row_groups = [
+            (path, i)
+            for path in self.list_files()
+            for i in range(pq.ParquetFile(path).num_row_groups)
+        ]
+        return row_groups[self.worker_id :: self.num_workers]
+
+    def load_batches(self, batch_size: int = 10_000) -> Iterator[DocBatch]:
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required for ParquetCorpusLoader. "
+                "Install it with `pip install fotla[parquet]`."
+            )
+
+        row_groups = self.assigned_row_groups()
+        if self.verbose:
+            row_groups = tqdm(row_groups, desc="Loading corpus")
+
+        for path, file_row_groups in groupby(row_groups, key=lambda x: x[0]):
+            parquet_file = pq.ParquetFile(path)
+            names = parquet_file.schema_arrow.names
+            columns = [name for name in self.columns if name in names]
+            for record_batch in parquet_file.iter_batches(
+                batch_size=batch_size,
+                row_groups=[i for _, i in file_row_groups],
+                columns=columns,
+            ):
+                batch_columns = {}
+                for name in columns:
+                    column = record_batch.column(name)
+                    if name == "doc_id":
+                        column = column.cast(pa.string())
+                    elif name in ("title", "text"):
+                        column = pc.fill_null(column.cast(pa.string()), "")
+                    batch_columns[name] = column.to_pylist()
+                yield DocBatch(batch_columns)
+
+    def load(self, batch_size: int = 10_000) -> Iterator[List[BaseModel]]:
+        for batch in self.load_batches(batch_size=batch_size):
+            yield batch.to_docs()
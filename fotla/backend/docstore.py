@@ -0,0 +1,191 @@
+import abc
+import json
+import mmap
+import os
+import threading
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+from fotla.backend.corpus_loader import DocBatch
+
+logger = getLogger(__name__)
+
+
+class DocStore(abc.ABC):
+    @abc.abstractmethod
+    def write(self, docs: Iterable[BaseModel]) -> int:
+        raise NotImplementedError
+
+    def write_batch(self, batch: DocBatch) -> int:
+        return self.write(batch.to_docs())
+
+    @abc.abstractmethod
+    def get_many(self, doc_ids: List[str]) -> List[Optional[Dict]]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Deletes all the stored documents."""
+        raise NotImplementedError
+
+
+class OffsetDocStore(DocStore):
+    """A key-value store of display fields keyed by doc_id.
+
+    The documents are appended as JSON to `docs.bin`, the end offset of each
+    document is appended to `offsets.bin` and its doc_id to `doc_ids.txt`. Reads
+    memory-map `docs.bin`, so fetching a page of hits only touches the pages of
+    those documents.
+
+    Writes and reads may run in different threads. A write does not touch the
+    memory map in use: it drops it, and the next read maps the grown files again.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        fields: Optional[List[str]] = None,
+        recreate: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.fields = fields
+        self.data_path = self.path / "docs.bin"
+        self.offsets_path = self.path / "offsets.bin"
+        self.doc_ids_path = self.path / "doc_ids.txt"
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._reader: Optional[
+            Tuple[Optional[mmap.mmap], np.ndarray, Dict[str, int]]
+        ] = None
+        if recreate:
+            self.clear()
+
+    def doc_to_dict(self, doc: BaseModel) -> Dict:
+        doc_dict = doc.model_dump()
+        if self.fields is None:
+            return {k: v for k, v in doc_dict.items() if k != "doc_id"}
+        return {field: doc_dict.get(field, None) for field in self.fields}
+
+    def write(self, docs: Iterable[BaseModel]) -> int:
+        """Appends the documents to the store.
+
+        Args:
+            docs: The documents to store.
+
+        Returns:
+            The number of documents written.
+        """
+        doc_ids: List[str] = []
+        doc_dicts: List[Dict] = []
+        for doc in docs:
+            doc_ids.append(str(doc.doc_id))
+            doc_dicts.append(self.doc_to_dict(doc))
+        return self.write_dicts(doc_ids, doc_dicts)
+
+    def write_batch(self, batch: DocBatch) -> int:
+        """Appends a columnar batch of documents to the store.
+
+        Args:
+            batch: The documents to store.
+
+        Returns:
+            The number of documents written.
+        """
+        if self.fields is None:
+            names = [name for name in batch.columns if name != "doc_id"]
+        else:
+            names = self.fields
+        columns = [(name, batch.column(name)) for name in names]
+        doc_dicts = [
+            {name: column[i] for name, column in columns} for i in range(len(batch))
+        ]
+        return self.write_dicts(batch.doc_ids, doc_dicts)
+
+    def write_dicts(self, doc_ids: List[str], doc_dicts: List[Dict]) -> int:
+        data = [json.dumps(d, ensure_ascii=False).encode("utf-8") for d in doc_dicts]
+        with self.lock:
+            with open(self.data_path, "ab") as f:
+                start = f.tell()
+                for doc_data in data:
+                    f.write(doc_data)
+            ends = start + np.cumsum([len(doc_data) for doc_data in data])
+
+            with open(self.offsets_path, "ab") as f:
+                ends.astype(np.int64).tofile(f)
+            with open(self.doc_ids_path, "a") as f:
+                f.writelines(doc_id + "\n" for doc_id in doc_ids)
+
+            # readers holding the previous map keep using it until they finish
+            self._reader = None
+        return len(doc_ids)
+
+    def load_reader(self) -> Tuple[Optional[mmap.mmap], np.ndarray, Dict[str, int]]:
+        if not self.offsets_path.exists():
+            return None, np.zeros(1, dtype=np.int64), {}
+
+        ends = np.fromfile(self.offsets_path, dtype=np.int64)
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64), ends])
+        with open(self.doc_ids_path) as f:
+            rows = {line.rstrip("\n"): row for row, line in enumerate(f)}
+
+        data_mmap = None
+        with open(self.data_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                data_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return data_mmap, offsets, rows
+
+    def open(self) -> Tuple[Optional[mmap.mmap], np.ndarray, Dict[str, int]]:
+        """Memory-maps the store for reading, unless it is already mapped.
+
+        Returns:
+            The memory map of `docs.bin`, the document offsets and the row of
+            each doc_id.
+        """
+        reader = self._reader
+        if reader is not None:
+            return reader
+
+        with self.lock:
+            if self._reader is None:
+                self._reader = self.load_reader()
+            return self._reader
+
+    def close(self) -> None:
+        """Unmaps the store. Must not be called while `get_many` is running."""
+        with self.lock:
+            if self._reader is not None and self._reader[0] is not None:
+                self._reader[0].close()
+            self._reader = None
+
+    def clear(self) -> None:
+        """Deletes all the stored documents."""
+        with self.lock:
+            for file_path in (self.data_path, self.offsets_path, self.doc_ids_path):
+                if file_path.exists():
+                    file_path.unlink()
+            self._reader = None
+
+    def get_many(self, doc_ids: List[str]) -> List[Optional[Dict]]:
+        """Fetches the stored fields of the given documents.
+
+        Args:
+            doc_ids: The doc_ids to fetch.
+
+        Returns:
+            The stored fields of each document, or None if it is not stored.
+        """
+        data_mmap, offsets, rows = self.open()
+
+        docs: List[Optional[Dict]] = []
+        for doc_id in doc_ids:
+            row = rows.get(doc_id)
+            if row is None or data_mmap is None:
+                docs.append(None)
+                continue
+            start, end = offsets[row], offsets[row + 1]
+            docs.append(json.loads(data_mmap[start:end].decode("utf-8")))
+        return docs
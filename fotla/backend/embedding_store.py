@@ -0,0 +1,248 @@
+import json
+from logging import getLogger
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from fotla.backend.corpus_loader import CorpusLoader, Doc, DocBatch
+from fotla.backend.encoder import DenseEncoder
+from fotla.backend.indexer import DenseIndexer, VecRecord
+from fotla.backend.retriever import batch_to_texts
+
+logger = getLogger(__name__)
+
+
+class EmbeddingShardWriter(object):
+    """Writes embeddings to sharded `.npy` files with a doc_id sidecar per shard.
+
+    Each shard `shard-00000.npy` holds up to `shard_size` rows, and the doc_ids of
+    its rows are written line by line to `shard-00000.ids.txt`. `manifest.json`
+    lists the shards once the writer is closed. If the writer exits with an
+    exception, the manifest lists the shards written so far and is marked as
+    incomplete. The `.npy` files can be memory-mapped with
+    `np.load(path, mmap_mode="r")`.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        shard_size: int = 100_000,
+        dtype: str = "float16",
+    ) -> None:
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"dtype {dtype} not supported.")
+
+        self.path = Path(path)
+        self.shard_size = shard_size
+        self.dtype = dtype
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.path / "manifest.json"
+        # a manifest left by a previous run would describe shards being overwritten
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+
+        self.shards: List[dict] = []
+        self.dim: Optional[int] = None
+        self._doc_ids: List[str] = []
+        self._embeddings: List[np.ndarray] = []
+        self._buffered = 0
+
+    def __enter__(self) -> "EmbeddingShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+            return
+
+        # the buffered rows are dropped, as the input may have failed midway
+        logger.warning(f"writer failed, marking {self.path} as incomplete.")
+        self.write_manifest(complete=False)
+
+    def write(self, doc_ids: List[str], embeddings: np.ndarray) -> None:
+        if len(doc_ids) != len(embeddings):
+            raise ValueError("The number of doc_ids and embeddings must be equal.")
+
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+
+        start = 0
+        while start < len(doc_ids):
+            end = start + self.shard_size - self._buffered
+            self._doc_ids.extend(doc_ids[start:end])
+            self._embeddings.append(embeddings[start:end].astype(self.dtype))
+            self._buffered += len(embeddings[start:end])
+            start = end
+            if self._buffered >= self.shard_size:
+                self.flush()
+
+    def flush(self) -> None:
+        if self._buffered <= 0:
+            return
+
+        name = f"shard-{len(self.shards):05d}"
+        np.save(self.path / f"{name}.npy", np.concatenate(self._embeddings))
+        with open(self.path / f"{name}.ids.txt", "w") as f:
+            f.writelines(str(doc_id) + "\n" for doc_id in self._doc_ids)
+        self.shards.append({"name": name, "count": self._buffered})
+        logger.info(f"wrote {self._buffered} embeddings to {name}.")
+
+        self._doc_ids, self._embeddings, self._buffered = [], [], 0
+
+    def write_manifest(self, complete: bool) -> None:
+        manifest = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "complete": complete,
+            "shards": self.shards,
+        }
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def close(self) -> None:
+        self.flush()
+        self.write_manifest(complete=True)
+
+
+class EmbeddingShardReader(object):
+    """Reads the shards written by `EmbeddingShardWriter` through memory maps.
+
+    Only shard sets whose writer was closed successfully can be read.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path / "manifest.json") as f:
+            self.manifest = json.load(f)
+
+        if not self.manifest.get("complete", False):
+            raise ValueError(
+                f"The embeddings in {self.path} are incomplete. "
+                "Encode the corpus again."
+            )
+
+        self._shard_i = 0
+        self._offset = 0
+        self._shard: Optional[Tuple[List[str], np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return sum(shard["count"] for shard in self.manifest["shards"])
+
+    def load_shard(self, name: str) -> Tuple[List[str], np.ndarray]:
+        embeddings = np.load(self.path / f"{name}.npy", mmap_mode="r")
+        with open(self.path / f"{name}.ids.txt") as f:
+            doc_ids = [line.rstrip("\n") for line in f]
+        return doc_ids, embeddings
+
+    def iter_shards(self) -> Iterator[Tuple[List[str], np.ndarray]]:
+        for shard in self.manifest["shards"]:
+            yield self.load_shard(shard["name"])
+
+    def take(self, n: int) -> Tuple[List[str], np.ndarray]:
+        """Reads the next n rows, continuing over shard boundaries.
+
+        Args:
+            n: The number of rows to read.
+
+        Returns:
+            The doc_ids and float32 embeddings of up to n rows.
+        """
+        doc_ids: List[str] = []
+        embeddings: List[np.ndarray] = []
+        shards = self.manifest["shards"]
+        while n > 0 and self._shard_i < len(shards):
+            if self._shard is None:
+                self._shard = self.load_shard(shards[self._shard_i]["name"])
+
+            shard_doc_ids, shard_embeddings = self._shard
+            end = min(self._offset + n, len(shard_doc_ids))
+            doc_ids.extend(shard_doc_ids[self._offset : end])
+            embeddings.append(shard_embeddings[self._offset : end])
+            n -= end - self._offset
+            self._offset = end
+
+            if self._offset >= len(shard_doc_ids):
+                self._shard_i, self._offset, self._shard = self._shard_i + 1, 0, None
+
+        if len(embeddings) <= 0:
+            return [], np.empty((0, self.manifest["dim"]), dtype=np.float32)
+        return doc_ids, np.concatenate(embeddings).astype(np.float32)
+
+    def iter_batches(self, batch_size: int) -> Iterator[Tuple[List[str], np.ndarray]]:
+        while True:
+            doc_ids, embeddings = self.take(batch_size)
+            if len(doc_ids) <= 0:
+                return
+            yield doc_ids, embeddings
+
+
+def export_embeddings(
+    encoder: DenseEncoder,
+    corpus_loader: CorpusLoader,
+    writer: EmbeddingShardWriter,
+    batch_size: int = 10_000,
+    batch_to_texts: Callable[[DocBatch], List[str]] = batch_to_texts,
+) -> int:
+    """Encodes the corpus and writes the embeddings, without any indexer.
+
+    Returns:
+        The number of documents encoded.
+    """
+    encoded_total = 0
+    with writer:
+        for batch in corpus_loader.load_batches(batch_size=batch_size):
+            embeddings = encoder.encode_corpus(batch_to_texts(batch))
+            writer.write(batch.doc_ids, embeddings)
+            encoded_total += len(batch)
+    logger.info(f"Encoded {encoded_total} documents.")
+    return encoded_total
+
+
+def import_embeddings(
+    vector_indexer: DenseIndexer,
+    reader: EmbeddingShardReader,
+    corpus_loader: Optional[CorpusLoader] = None,
+    batch_size: int = 10_000,
+) -> int:
+    """Indexes precomputed embeddings with the concurrent `async_index`.
+
+    If `corpus_loader` is given, it must yield the documents in the order they
+    were encoded, and their fields are indexed along with the vectors. Otherwise
+    only doc_id and the vector are indexed.
+
+    Returns:
+        The number of documents written.
+
+    Raises:
+        ValueError: If the corpus and the embeddings do not hold the same
+            documents in the same order.
+    """
+
+    def yield_records(docs: List[Doc], embeddings: np.ndarray):
+        for doc, vec in zip(docs, embeddings):
+            yield VecRecord(doc=doc, vec=vec)
+
+    write_total = 0
+    if corpus_loader is None:
+        for doc_ids, embeddings in reader.iter_batches(batch_size):
+            docs = [Doc(doc_id=doc_id, text="") for doc_id in doc_ids]
+            write_total += vector_indexer.async_index(yield_records(docs, embeddings))
+    else:
+        for batch in corpus_loader.load_batches(batch_size=batch_size):
+            doc_ids, embeddings = reader.take(len(batch))
+            if doc_ids != [str(doc_id) for doc_id in batch.doc_ids]:
+                raise ValueError(
+                    "The corpus does not match the embeddings. "
+                    "Load the corpus the embeddings were encoded from."
+                )
+            records = yield_records(batch.to_docs(), embeddings)
+            write_total += vector_indexer.async_index(records)
+        if len(reader.take(1)[0]) > 0:
+            raise ValueError(
+                "The embeddings have more documents than the corpus. "
+                "Load the corpus the embeddings were encoded from."
+            )
+
+    logger.info(f"Indexed {write_total} documents.")
+    return write_total
@@ -1,6 +1,7 @@
 import abc
+import string
 from logging import getLogger
-from typing import Callable, Iterable, List, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -15,6 +16,28 @@ from fotla.backend.indexer import DenseIndexer, VecRecord
 logger = getLogger(__name__)
 
 
+def load_hf_model(
+    model_path: str, device: str, model_class: Optional[type] = None
+) -> Tuple[PreTrainedTokenizerBase, PreTrainedModel]:
+    """Loads a tokenizer and a model in eval mode on the device.
+
+    Args:
+        model_path: The name or path of the model.
+        device: The device to put the model on.
+        model_class: The auto class to load the model with. Defaults to AutoModel.
+    """
+    from transformers import AutoModel, AutoTokenizer
+
+    model_class = model_class or AutoModel
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = model_class.from_pretrained(model_path)
+
+    model.eval()
+    model.to(device)
+
+    return tokenizer, model
+
+
 class DenseEncoder(abc.ABC):
     def encode_corpus(self, texts: Iterable[str]) -> Tuple[np.ndarray, List[str]]:
         raise NotImplementedError
@@ -35,15 +58,7 @@ class HFSymetricDenseEncoder(DenseEncoder):
     def load_model(
         self, model_path: str, device: str
     ) -> Tuple[PreTrainedTokenizerBase, PreTrainedModel]:
-        from transformers import AutoModel, AutoTokenizer
-
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModel.from_pretrained(model_path)
-
-        model.eval()
-        model.to(device)
-
-        return tokenizer, model
+        return load_hf_model(model_path, device)
 
     def pooling(
         self, outputs: np.ndarray, attention_mask: np.ndarray, pooling_method: str
@@ -100,6 +115,299 @@ class HFSymetricDenseEncoder(DenseEncoder):
         return self.encode(queries, pooling, batch_size)
 
 
+class MultiVectorEncoder(abc.ABC):
+    def encode_corpus(self, texts: Iterable[str]) -> List[np.ndarray]:
+        raise NotImplementedError
+
+    def encode_queries(self, queries: Iterable[str]) -> List[np.ndarray]:
+        raise NotImplementedError
+
+
+def load_checkpoint_tensor(model_path: str, key: str) -> Optional[torch.Tensor]:
+    """Reads one tensor from a (non-sharded) HF checkpoint.
+
+    This is for the weights that the `AutoModel` classes drop when loading, such
+    as the linear projection head of a ColBERT checkpoint.
+
+    Args:
+        model_path: The name or path of the model.
+        key: The name of the tensor in the state dict.
+
+    Returns:
+        The tensor, or None if the checkpoint does not have it.
+    """
+    from transformers.utils import cached_file
+
+    for filename in ("model.safetensors", "pytorch_model.bin"):
+        try:
+            path = cached_file(model_path, filename)
+        except OSError:
+            continue
+
+        if filename.endswith(".safetensors"):
+            from safetensors import safe_open
+
+            with safe_open(path, framework="pt") as f:
+                return f.get_tensor(key) if key in f.keys() else None
+        state_dict = torch.load(path, map_location="cpu", weights_only=True)
+        return state_dict.get(key)
+    return None
+
+
+class HFMultiVectorEncoder(MultiVectorEncoder):
+    """Encodes texts into one normalized embedding per token (ColBERT-style).
+
+    Padding tokens are dropped, so each text yields a (num_tokens, dim) array.
+
+    By default the token embeddings are the hidden states of `AutoModel`, which
+    suits any encoder trained to be used that way. ColBERT checkpoints need
+    their own input format and projection head, see `from_colbert`.
+
+    Args:
+        model_path: The name or path of the model.
+        verbose: Whether to show a progress bar.
+        device: The device to run the model on.
+        doc_maxlen: The maximum number of tokens of a document.
+        query_maxlen: The maximum number of tokens of a query.
+        projection_key: The name of a (dim, hidden_size) linear layer in the
+            checkpoint applied to the hidden states, if the checkpoint has it.
+        query_marker: A token inserted after [CLS] of the queries.
+        doc_marker: A token inserted after [CLS] of the documents.
+        query_augmentation: If True, queries are padded to `query_maxlen` with
+            [MASK] tokens whose embeddings are kept.
+        skip_punctuation: If True, the embeddings of punctuation tokens are
+            dropped from the documents.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        verbose: bool = True,
+        device: str = "cuda:0",
+        doc_maxlen: int = 180,
+        query_maxlen: int = 32,
+        projection_key: Optional[str] = "linear.weight",
+        query_marker: Optional[str] = None,
+        doc_marker: Optional[str] = None,
+        query_augmentation: bool = False,
+        skip_punctuation: bool = False,
+    ) -> None:
+        self.device = device
+        self.verbose = verbose
+        self.doc_maxlen = doc_maxlen
+        self.query_maxlen = query_maxlen
+        self.query_marker = query_marker
+        self.doc_marker = doc_marker
+        self.query_augmentation = query_augmentation
+
+        self.tokenizer, self.model = load_hf_model(model_path, self.device)
+
+        self.projection: Optional[torch.Tensor] = None
+        if projection_key is not None:
+            projection = load_checkpoint_tensor(model_path, projection_key)
+            if projection is not None:
+                self.projection = projection.to(self.device, self.model.dtype)
+                logger.info(f"projecting token embeddings with {projection_key}.")
+
+        self.skip_ids: Optional[torch.Tensor] = None
+        if skip_punctuation:
+            ids = self.tokenizer.convert_tokens_to_ids(list(string.punctuation))
+            ids = [i for i in ids if i != self.tokenizer.unk_token_id]
+            self.skip_ids = torch.tensor(ids, dtype=torch.long, device=self.device)
+
+    @classmethod
+    def from_colbert(cls, model_path: str, **kwargs) -> "HFMultiVectorEncoder":
+        """Creates an encoder with the input format of ColBERT v1/v2 checkpoints.
+
+        The queries and documents are marked with [unused0] and [unused1],
+        queries are augmented with [MASK] tokens, punctuation is skipped in the
+        documents, and the `linear` head of the checkpoint is applied.
+        """
+        params = {
+            "query_marker": "[unused0]",
+            "doc_marker": "[unused1]",
+            "query_augmentation": True,
+            "skip_punctuation": True,
+        }
+        params.update(kwargs)
+        return cls(model_path, **params)
+
+    def tokenize(
+        self, texts: List[str], max_length: int, marker: Optional[str], augment: bool
+    ) -> Dict[str, torch.Tensor]:
+        # a position is reserved for the marker, inserted after [CLS]
+        length = max_length - 1 if marker is not None else max_length
+        inputs = dict(
+            self.tokenizer(
+                texts,
+                padding="max_length" if augment else True,
+                truncation=True,
+                max_length=length,
+                return_tensors='pt',
+            )
+        )
+        if augment:
+            input_ids = inputs["input_ids"]
+            input_ids[input_ids == self.tokenizer.pad_token_id] = (
+                self.tokenizer.mask_token_id
+            )
+
+        if marker is not None:
+            marker_id = self.tokenizer.convert_tokens_to_ids(marker)
+            for key, value in inputs.items():
+                first = value[:, :1]
+                inserted = torch.full_like(first, marker_id)
+                if key != "input_ids":
+                    # the marker is attended and has the type of [CLS]
+                    inserted = first
+                inputs[key] = torch.cat([first, inserted, value[:, 1:]], dim=1)
+        return inputs
+
+    def encode(
+        self,
+        texts: Iterable[str],
+        max_length: int,
+        batch_size: int = 16,
+        marker: Optional[str] = None,
+        augment: bool = False,
+        skip_ids: Optional[torch.Tensor] = None,
+    ) -> List[np.ndarray]:
+        embeddings: List[np.ndarray] = []
+        texts_iter = tqdm(texts, desc="encoding") if self.verbose else texts
+        for chunk in chunked(texts_iter, batch_size):
+            inputs = self.tokenize(chunk, max_length, marker, augment)
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+                hidden_states = outputs[0]
+                if self.projection is not None:
+                    hidden_states = hidden_states @ self.projection.T
+                token_embeddings = torch.nn.functional.normalize(
+                    hidden_states, dim=-1
+                )
+
+            # the [MASK] tokens of augmented queries are not attended but kept
+            if augment:
+                mask = torch.ones_like(inputs['input_ids'], dtype=torch.bool)
+            else:
+                mask = inputs['attention_mask'].bool()
+            if skip_ids is not None:
+                mask &= ~torch.isin(inputs['input_ids'], skip_ids)
+
+            token_embeddings = token_embeddings.detach().cpu().numpy()
+            mask = mask.cpu().numpy()
+            for emb, emb_mask in zip(token_embeddings, mask):
+                embeddings.append(emb[emb_mask])
+
+        return embeddings
+
+    def encode_corpus(
+        self, texts: Iterable[str], batch_size: int = 16
+    ) -> List[np.ndarray]:
+        return self.encode(
+            texts,
+            self.doc_maxlen,
+            batch_size,
+            marker=self.doc_marker,
+            skip_ids=self.skip_ids,
+        )
+
+    def encode_queries(
+        self, queries: Iterable[str], batch_size: int = 16
+    ) -> List[np.ndarray]:
+        return self.encode(
+            queries,
+            self.query_maxlen,
+            batch_size,
+            marker=self.query_marker,
+            augment=self.query_augmentation,
+        )
+
+
+class SparseEncoder(abc.ABC):
+    def encode_corpus(self, texts: Iterable[str]) -> List[Dict[str, float]]:
+        raise NotImplementedError
+
+    def encode_queries(self, queries: Iterable[str]) -> List[Dict[str, float]]:
+        raise NotImplementedError
+
+
+class HFSpladeEncoder(SparseEncoder):
+    """Encodes texts into term weights with a SPLADE masked language model.
+
+    The weight of each vocabulary term is max over tokens of log(1 + relu(logit)),
+    and only the `doc_topk` (or `query_topk`) heaviest terms are kept.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        verbose: bool = True,
+        device: str = "cuda:0",
+        doc_topk: int = 256,
+        query_topk: int = 64,
+        max_length: int = 256,
+    ) -> None:
+        self.device = device
+        self.verbose = verbose
+        self.doc_topk = doc_topk
+        self.query_topk = query_topk
+        self.max_length = max_length
+
+        from transformers import AutoModelForMaskedLM
+
+        self.tokenizer, self.model = load_hf_model(
+            model_path, self.device, AutoModelForMaskedLM
+        )
+
+    def encode(
+        self, texts: Iterable[str], topk: int, batch_size: int = 16
+    ) -> List[Dict[str, float]]:
+        term_weights: List[Dict[str, float]] = []
+        texts_iter = tqdm(texts, desc="encoding") if self.verbose else texts
+        for chunk in chunked(texts_iter, batch_size):
+            inputs = self.tokenizer(
+                chunk,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='pt',
+            )
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+            with torch.no_grad():
+                logits = self.model(**inputs).logits
+                weights = torch.log1p(torch.relu(logits))
+                weights = weights * inputs['attention_mask'][..., None]
+                weights = weights.max(dim=1).values
+
+                k = min(topk, weights.shape[1])
+                top_weights, top_ids = weights.topk(k, dim=1)
+
+            top_weights = top_weights.cpu().numpy()
+            top_ids = top_ids.cpu().numpy()
+            for doc_weights, doc_ids in zip(top_weights, top_ids):
+                nonzero = doc_weights > 0
+                term_ids = doc_ids[nonzero].tolist()
+                terms = self.tokenizer.convert_ids_to_tokens(term_ids)
+                term_weights.append(
+                    dict(zip(terms, doc_weights[nonzero].astype(float).tolist()))
+                )
+
+        return term_weights
+
+    def encode_corpus(
+        self, texts: Iterable[str], batch_size: int = 16
+    ) -> List[Dict[str, float]]:
+        return self.encode(texts, self.doc_topk, batch_size)
+
+    def encode_queries(
+        self, queries: Iterable[str], batch_size: int = 16
+    ) -> List[Dict[str, float]]:
+        return self.encode(queries, self.query_topk, batch_size)
+
+
 class Retriever(abc.ABC):
     def index(self, corpus: CorpusLoader):
         raise NotImplementedError
@@ -1 +1,3 @@
 from .base import DenseIndexer, VecRecord
+from .federated import FederatedIndexer
+from .multivector import MultiVectorIndexer
@@ -4,6 +4,8 @@ from typing import Annotated, Any, Dict, Iterable, List, Optional, Tuple
 import numpy as np
 from pydantic import BaseModel, PlainValidator, ValidationInfo
 
+from fotla.backend.corpus_loader import DocBatch
+
 
 def ndarray_valicate(v: Any, info: ValidationInfo) -> np.ndarray:
     if not isinstance(v, np.ndarray):
@@ -17,6 +19,7 @@ NdArray = Annotated[np.ndarray, PlainValidator(ndarray_valicate)]
 class VecRecord(BaseModel):
     doc: BaseModel
     vec: Optional[NdArray] = None
+    sparse: Optional[Dict[str, float]] = None
 
 
 class DenseIndexer(abc.ABC):
@@ -24,6 +27,31 @@ class DenseIndexer(abc.ABC):
     def index(self, records: Iterable[VecRecord]) -> int:
         raise NotImplementedError
 
+    def after_fork(self) -> None:
+        """Re-creates the connections that must not be shared after a fork."""
+
+    def query_sparse(
+        self,
+        queries: List[str],
+        term_weights: List[Dict[str, float]],
+        max_query_terms: Optional[int] = None,
+        term_fields: List[str] = [],
+        top_k: int = 10,
+        from_: int = 0,
+        size: int = 10,
+        **kwargs,
+    ) -> List[Tuple[str, Dict]]:
+        raise NotImplementedError
+
+    def index_batch(
+        self, batch: DocBatch, vectors: Optional[np.ndarray] = None
+    ) -> int:
+        docs = batch.to_docs()
+        if vectors is None:
+            return self.index(docs)
+        records = (VecRecord(vec=vec, doc=doc) for vec, doc in zip(vectors, docs))
+        return self.index(records)
+
     @abc.abstractmethod
     def query(
         self,
@@ -35,5 +63,24 @@ class DenseIndexer(abc.ABC):
         from_: int = 0,
         size: int = 10,
         source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+        request_timeout: Optional[float] = None,
+        hydrate: bool = True,
     ) -> List[Tuple[str, Dict]]:
         raise NotImplementedError
+
+    def hydrate_hits(
+        self,
+        hits: List[Dict],
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Dict]:
+        """Fills `_source` of the hits of a query run with `hydrate=False`.
+
+        Callers that fetch more hits than they return (to merge or re-rank them)
+        query with `hydrate=False` and hydrate only the hits they return.
+        """
+        return hits
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, TypeVar
+
+import elasticsearch
+import numpy as np
+
+logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = (429, 502, 503, 504)
+RETRYABLE_ERRORS = (elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout)
+
+
+@dataclass
+class AsyncBulkConfig:
+    concurrency: int = 4
+    batch_size: int = 500
+    min_batch_size: int = 50
+    max_batch_size: int = 5_000
+    target_latency: float = 1.0
+    max_retries: int = 5
+    initial_backoff: float = 1.0
+    max_backoff: float = 60.0
+    request_timeout: float = 60.0
+    dead_letter_path: Optional[str] = None
+
+
+def run_coroutine(coro: Awaitable[T]) -> T:
+    """Runs the coroutine to completion from synchronous code.
+
+    If an event loop is already running in this thread, the coroutine is run on
+    a new loop in another thread instead of failing.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def json_default(obj: Any) -> Any:
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+class AsyncBulkIndexer(object):
+    """Sends bulk requests with bounded concurrency, backoff and retries.
+
+    Up to `concurrency` bulk requests are in flight, and the producer blocks when
+    they are all busy. The batch size grows while requests are faster than
+    `target_latency` and is halved when they are slower or rejected (429).
+    Rejected documents are retried with exponential backoff. A batch rejected as
+    too large (413) is split in halves and sent again. Documents that fail
+    permanently are written to `dead_letter_path`.
+    """
+
+    def __init__(self, url: str, config: Optional[AsyncBulkConfig] = None) -> None:
+        self.url = url
+        self.config = config or AsyncBulkConfig()
+        self.batch_size = self.config.batch_size
+        self.write_count = 0
+        self.failed_count = 0
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.config.max_backoff, self.config.initial_backoff * 2**attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    def adapt_batch_size(self, latency: float, rejected: bool) -> None:
+        if rejected or latency > self.config.target_latency:
+            self.batch_size = max(self.config.min_batch_size, self.batch_size // 2)
+        else:
+            self.batch_size = min(
+                self.config.max_batch_size, int(self.batch_size * 1.25) + 1
+            )
+
+    def dead_letter(self, actions: List[Dict], error: Any) -> None:
+        self.failed_count += len(actions)
+        logger.error(f"failed to index {len(actions)} documents: {error}")
+        if self.config.dead_letter_path is None:
+            return
+
+        with open(self.config.dead_letter_path, "a") as f:
+            for action in actions:
+                line = {"action": action, "error": error}
+                f.write(json.dumps(line, default=json_default) + "\n")
+
+    def create_operations(self, actions: List[Dict]) -> List[Dict]:
+        operations: List[Dict] = []
+        for action in actions:
+            header = {"_index": action["_index"]}
+            if "_id" in action:
+                header["_id"] = action["_id"]
+            operations.append({action.get("_op_type", "index"): header})
+            operations.append(action["_source"])
+        return operations
+
+    async def send(
+        self, client: elasticsearch.AsyncElasticsearch, actions: List[Dict]
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while len(actions) > 0:
+            operations = self.create_operations(actions)
+            started = loop.time()
+            try:
+                response = await client.bulk(operations=operations)
+            except elasticsearch.ApiError as e:
+                if e.meta.status == 413 and len(actions) > 1:
+                    await self.split(client, actions)
+                    return
+                if e.meta.status not in RETRYABLE_STATUS:
+                    self.dead_letter(actions, str(e))
+                    return
+                error: Any = e
+            except RETRYABLE_ERRORS as e:
+                error = e
+            except elasticsearch.TransportError as e:
+                # e.g. SerializationError, which fails the same way when retried
+                self.dead_letter(actions, str(e))
+                return
+            else:
+                error = None
+
+            if error is not None:
+                self.adapt_batch_size(loop.time() - started, rejected=True)
+                if attempt >= self.config.max_retries:
+                    self.dead_letter(actions, str(error))
+                    return
+                logger.warning(f"bulk request failed, retrying: {error}")
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            retry: List[Dict] = []
+            for action, item in zip(actions, response["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 0)
+                if 200 <= status < 300:
+                    self.write_count += 1
+                elif status in RETRYABLE_STATUS and attempt < self.config.max_retries:
+                    retry.append(action)
+                else:
+                    self.dead_letter([action], result.get("error"))
+
+            self.adapt_batch_size(loop.time() - started, rejected=len(retry) > 0)
+            if len(retry) > 0:
+                logger.warning(f"{len(retry)} documents rejected, retrying.")
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+            actions = retry
+
+    async def split(
+        self, client: elasticsearch.AsyncElasticsearch, actions: List[Dict]
+    ) -> None:
+        """Sends the halves of a batch that was rejected as too large."""
+        middle = len(actions) // 2
+        self.batch_size = max(1, min(self.batch_size // 2, middle))
+        logger.warning(f"bulk request of {len(actions)} documents is too large.")
+        await self.send(client, actions[:middle])
+        await self.send(client, actions[middle:])
+
+    async def worker(
+        self, client: elasticsearch.AsyncElasticsearch, queue: asyncio.Queue
+    ) -> None:
+        while True:
+            actions = await queue.get()
+            if actions is None:
+                return
+            await self.send(client, actions)
+
+    async def put(
+        self, queue: asyncio.Queue, item: Any, workers: List[asyncio.Task]
+    ) -> None:
+        """Puts the item to the queue, failing fast if a worker has crashed.
+
+        Workers that returned after taking a sentinel are not an error, but the
+        put fails if no worker is left to take the item.
+        """
+        put_task = asyncio.ensure_future(queue.put(item))
+        try:
+            while True:
+                for task in workers:
+                    if task.done() and task.exception() is not None:
+                        task.result()
+                if put_task.done():
+                    return
+                alive = [task for task in workers if not task.done()]
+                if len(alive) <= 0:
+                    raise RuntimeError("all bulk workers exited.")
+                await asyncio.wait(
+                    [put_task, *alive], return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            put_task.cancel()
+
+    async def run(self, actions: Iterable[Dict]) -> int:
+        """Indexes the actions.
+
+        Args:
+            actions: The bulk actions, with "_index", "_source" and optionally
+                "_op_type" and "_id".
+
+        Returns:
+            The number of documents written.
+        """
+        self.write_count, self.failed_count = 0, 0
+        async with elasticsearch.AsyncElasticsearch(
+            self.url, request_timeout=self.config.request_timeout
+        ) as client:
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.config.concurrency)
+            workers = [
+                asyncio.create_task(self.worker(client, queue))
+                for _ in range(self.config.concurrency)
+            ]
+            try:
+                batch: List[Dict] = []
+                for action in actions:
+                    batch.append(action)
+                    if len(batch) >= self.batch_size:
+                        await self.put(queue, batch, workers)
+                        batch = []
+                if len(batch) > 0:
+                    await self.put(queue, batch, workers)
+                for _ in workers:
+                    await self.put(queue, None, workers)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+
+        if self.failed_count > 0:
+            logger.warning(f"{self.failed_count} documents failed to be indexed.")
+        return self.write_count
@@ -8,14 +8,44 @@ import numpy as np
 from pydantic import BaseModel
 from tqdm import tqdm
 
-from fotla.backend.corpus_loader import CorpusLoader
+from fotla.backend.corpus_loader import CorpusLoader, DocBatch
+from fotla.backend.docstore import DocStore
 from fotla.backend.indexer import DenseIndexer, VecRecord
+from fotla.backend.indexer.bulk import (
+    AsyncBulkConfig,
+    AsyncBulkIndexer,
+    run_coroutine,
+)
 from fotla.backend.retriever import Retriever
 from fotla.backend.utils import project_dir
 
 logger = getLogger(__name__)
 
 
+def prune_term_weights(
+    term_weights: Dict[str, float], max_terms: Optional[int] = None
+) -> Dict[str, float]:
+    """Keeps the heaviest terms usable as `rank_features` keys.
+
+    Terms containing a dot are dropped since they would be read as object paths.
+
+    Args:
+        term_weights: The weight of each term.
+        max_terms: The number of terms to keep. Keeps all if None.
+
+    Returns:
+        The pruned term weights.
+    """
+    items = [
+        (term, weight)
+        for term, weight in term_weights.items()
+        if weight > 0 and term and "." not in term
+    ]
+    if max_terms is not None and len(items) > max_terms:
+        items = sorted(items, key=lambda x: x[1], reverse=True)[:max_terms]
+    return dict(items)
+
+
 @dataclass
 class ElasticsearchConfig:
     host: str
@@ -31,22 +61,46 @@ class ElasticsearchIndexer(DenseIndexer):
         config: ElasticsearchConfig,
         fields: Optional[List[str]] = None,
         recreate_index: bool = False,
+        doc_store: Optional[DocStore] = None,
+        bulk_config: Optional[AsyncBulkConfig] = None,
     ) -> None:
+        """Connects to Elasticsearch and creates the index if needed.
+
+        Args:
+            config: The Elasticsearch config.
+            fields: The fields to index and return. Defaults to doc_id, title and
+                text.
+            recreate_index: If True, deletes the existing index and clears the
+                doc store first.
+            doc_store: If given, documents are also written to this store and the
+                returned hits are hydrated from it, so that the index only needs to
+                keep `doc_id` in `_source` (see `mappings_docstore.json`). Note that
+                highlighting is not available on fields missing from `_source`.
+            bulk_config: The settings of the bulk requests sent by `async_index`.
+        """
         self.config = config
         self.fields = fields
-        self.es = elasticsearch.Elasticsearch(
-            f"{self.config.schema}://{self.config.host}:{self.config.port}",
-        )
+        self.doc_store = doc_store
+        self.bulk_config = bulk_config
+        self.es = elasticsearch.Elasticsearch(self.url)
         self.index_name = self.config.index_name
         logger.info(f"setting index: {self.index_name}")
 
         if recreate_index and self.exist_index(self.index_name):
             self.delete_index(self.index_name)
+        if recreate_index and self.doc_store is not None:
+            self.doc_store.clear()
 
         if not self.exist_index(self.index_name):
             logger.info(f"Index {self.index_name} does not exist. creating...")
             self.create_index(self.index_name)
 
+    def after_fork(self) -> None:
+        """Re-creates the client so that no pooled connection is shared with the
+        parent process.
+        """
+        self.es = elasticsearch.Elasticsearch(self.url)
+
     def read_index_scheme(self) -> dict:
         """Reads the index scheme from the index scheme path.
 
@@ -86,56 +140,76 @@ class ElasticsearchIndexer(DenseIndexer):
         """
         return self.es.indices.exists(index=index_name)
 
-    def async_index(self, records: Iterable[BaseModel]) -> None:
-        try:
-            import asyncio
-        except ImportError:
-            raise ImportError("asyncio is required for async_index")
-
-        try:
-            from elasticsearch.helpers import async_streaming_bulk
-        except ImportError:
-            raise ImportError("elasticsearch-async is required for async_index")
-
-        from typing import AsyncIterable
-
-        async def async_create_index_body(
-            records: Iterable[BaseModel],
-        ) -> AsyncIterable[Dict]:
-            for record in records:
-                body = self.create_index_body(record, self.fields)
-
-                yield {
-                    "_op_type": "index",
-                    "_index": self.index_name,
-                    "_source": body,
-                }
+    @property
+    def url(self) -> str:
+        return f"{self.config.schema}://{self.config.host}:{self.config.port}"
 
-        async def main():
-            write_count = 0
-            async for ok, result in async_streaming_bulk(
-                es, async_create_index_body(records)
-            ):
-                action, result = result.popitem()
-                if not ok:
-                    print(f"failed to {action} document {result}")
-                else:
-                    write_count += 1
-            return write_count
-
-        es = elasticsearch.AsyncElasticsearch(
-            f"{self.config.schema}://{self.config.host}:{self.config.port}",
-        )
-        loop = asyncio.get_event_loop()
-        write_count = loop.run_until_complete(main())
-        return write_count
+    def iter_bulk_actions(self, records: Iterable[BaseModel]) -> Iterable[Dict]:
+        for record in self.iter_storing_docs(records):
+            yield {
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_source": self.create_index_body(record, self.fields),
+            }
+
+    async def aindex(self, records: Iterable[BaseModel]) -> int:
+        """Indexes the records with concurrent bulk requests.
+
+        See `AsyncBulkIndexer` for the concurrency, retry and dead-letter
+        behaviour, configured by `bulk_config`.
+
+        Args:
+            records: The records to index.
+
+        Returns:
+            The number of records written.
+        """
+        bulk_indexer = AsyncBulkIndexer(self.url, self.bulk_config)
+        return await bulk_indexer.run(self.iter_bulk_actions(records))
+
+    def async_index(self, records: Iterable[BaseModel]) -> int:
+        """Runs `aindex` to completion, also from inside a running event loop.
+
+        Args:
+            records: The records to index.
+
+        Returns:
+            The number of records written.
+        """
+        return run_coroutine(self.aindex(records))
+
+    def iter_storing_docs(
+        self, records: Iterable[BaseModel], buffer_size: int = 10_000
+    ) -> Iterable[BaseModel]:
+        """Passes the records through, writing their documents to the doc store.
+
+        Args:
+            records: The records to index.
+            buffer_size: The number of documents written to the store at once.
+
+        Returns:
+            The records.
+        """
+        if self.doc_store is None:
+            yield from records
+            return
+
+        buffer: List[BaseModel] = []
+        for record in records:
+            buffer.append(record.doc if isinstance(record, VecRecord) else record)
+            if len(buffer) >= buffer_size:
+                self.doc_store.write(buffer)
+                buffer = []
+            yield record
+        if len(buffer) > 0:
+            self.doc_store.write(buffer)
 
     def create_index_body(
         self, record: BaseModel, fields: Optional[List[str]]
     ) -> Dict:
-        vec = None
+        vec, sparse = None, None
         if isinstance(record, VecRecord):
-            record, vec = record.doc, record.vec
+            record, vec, sparse = record.doc, record.vec, record.sparse
 
         if fields is None:
             body = {
@@ -149,10 +223,17 @@ class ElasticsearchIndexer(DenseIndexer):
             for field in fields:
                 body[field] = record_dict.get(field, None)
 
-        if vec is not None:
+        if vec is not None and vec.ndim == 2:
+            # one vector per passage, indexed as nested documents
+            unit_vecs = vec / np.linalg.norm(vec, axis=1, keepdims=True)
+            body["passages"] = [{"vec": unit_vec} for unit_vec in unit_vecs]
+        elif vec is not None:
             unit_vec = vec / np.linalg.norm(vec)
             body["vec"] = unit_vec
 
+        if sparse is not None:
+            body["sparse"] = prune_term_weights(sparse)
+
         return body
 
     def index(
@@ -170,7 +251,7 @@ class ElasticsearchIndexer(DenseIndexer):
         """
 
         write_count = 0
-        for record in records:
+        for record in self.iter_storing_docs(records):
             body = self.create_index_body(record, self.fields)
 
             self.es.index(index=self.index_name, body=body, refresh=refresh)
@@ -178,6 +259,135 @@ class ElasticsearchIndexer(DenseIndexer):
 
         return write_count
 
+    def index_batch(
+        self,
+        batch: DocBatch,
+        vectors: Optional[np.ndarray] = None,
+        refresh: bool = False,
+    ) -> int:
+        """Bulk indexes a columnar batch of documents.
+
+        The bodies are built straight from the columns, without creating a model
+        per document.
+
+        Args:
+            batch: The documents to index.
+            vectors: The vectors of the documents, if any.
+            refresh: Whether to refresh the index after the bulk request.
+
+        Returns:
+            The number of documents written.
+        """
+        from elasticsearch.helpers import bulk
+
+        if self.doc_store is not None:
+            self.doc_store.write_batch(batch)
+
+        fields = ["doc_id", "title", "text"] if self.fields is None else self.fields
+        columns = [(field, batch.column(field)) for field in fields]
+        unit_vecs = None
+        if vectors is not None:
+            unit_vecs = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        def iter_actions() -> Iterable[Dict]:
+            for i in range(len(batch)):
+                body = {field: column[i] for field, column in columns}
+                if unit_vecs is not None:
+                    body["vec"] = unit_vecs[i]
+                yield {"_index": self.index_name, "_source": body}
+
+        write_count, errors = bulk(
+            self.es, iter_actions(), refresh=refresh, raise_on_error=False
+        )
+        for error in errors:
+            logger.warning(f"failed to index document {error}")
+        return write_count
+
+    def create_projection_param(
+        self,
+        vec_field: str,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> Dict:
+        """Creates the `_source` filtering and highlight parameters of a search.
+
+        Args:
+            vec_field: The vector field, which is never returned (nor is the
+                `sparse` field).
+            source: The fields to include in `_source`. Defaults to `self.fields`.
+            source_excludes: Extra fields to exclude from `_source`.
+            highlight_fields: The fields to return highlighted snippets for.
+            highlight_only: If True, returns the snippets without `_source`.
+
+        Returns:
+            The keyword arguments for `Elasticsearch.search`.
+        """
+        if highlight_only and not highlight_fields:
+            raise ValueError("highlight_fields must be given with highlight_only.")
+
+        param: Dict = {}
+        if highlight_only:
+            param["source"] = False
+        elif self.doc_store is not None:
+            param["source_includes"] = ["doc_id"]
+        else:
+            includes = self.fields if source is None else source
+            if includes is not None:
+                param["source_includes"] = includes
+            param["source_excludes"] = [vec_field, "sparse"] + (source_excludes or [])
+
+        if highlight_fields:
+            param["highlight"] = {
+                "fields": {field: {} for field in highlight_fields},
+            }
+        return param
+
+    def hydrate_hits(
+        self,
+        hits: List[Dict],
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Dict]:
+        """Fills `_source` of the hits with the fields kept in the doc store.
+
+        Does nothing without a doc store or if only highlights are returned.
+
+        Args:
+            hits: The hits returned by Elasticsearch.
+            source: The fields to include. Defaults to `self.fields`.
+            source_excludes: The fields to exclude.
+            highlight_only: Whether the hits were queried with highlight_only.
+
+        Returns:
+            The hits.
+        """
+        if self.doc_store is None or highlight_only:
+            return hits
+
+        includes = self.fields if source is None else source
+        excludes = set(source_excludes or [])
+
+        doc_ids = [hit["_source"]["doc_id"] for hit in hits]
+        for hit, stored in zip(hits, self.doc_store.get_many(doc_ids)):
+            if stored is None:
+                continue
+            for field, value in stored.items():
+                if includes is not None and field not in includes:
+                    continue
+                if field not in excludes:
+                    hit["_source"][field] = value
+        return hits
+
+    def search_client(
+        self, request_timeout: Optional[float]
+    ) -> elasticsearch.Elasticsearch:
+        if request_timeout is None:
+            return self.es
+        return self.es.options(request_timeout=request_timeout)
+
     def query(
         self,
         queries: List[str],
@@ -188,13 +398,30 @@ class ElasticsearchIndexer(DenseIndexer):
         from_: int = 0,
         size: int = 10,
         source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+        inner_hits: Optional[Dict] = None,
         operator: str = "and",
+        request_timeout: Optional[float] = None,
+        hydrate: bool = True,
     ) -> List[Tuple[str, Dict]]:
         """Returns the top_k most similar vectors to the given vectors.
 
+        The vector field is always excluded from the returned `_source`.
+
         Args:
             vectors: The vectors to query.
             top_k: The number of similar vectors to return.
+            source: The fields to include in `_source`. Defaults to `self.fields`.
+            source_excludes: Extra fields to exclude from `_source`.
+            highlight_fields: The fields to return highlighted snippets for.
+            highlight_only: If True, returns the snippets without `_source`.
+            inner_hits: The inner_hits option of a knn search on a nested vector
+                field (e.g. "passages.vec").
+            request_timeout: The timeout in seconds of each search request.
+            hydrate: If False, the hits are not hydrated from the doc store (see
+                `hydrate_hits`).
 
         Returns:
             The indices of the top_k most similar vectors.
@@ -209,6 +436,11 @@ class ElasticsearchIndexer(DenseIndexer):
                 "The number of vectors must be equal to the number of queries."
             )
 
+        projection = self.create_projection_param(
+            vec_field, source, source_excludes, highlight_fields, highlight_only
+        )
+
+        es = self.search_client(request_timeout)
         results: List[Tuple[str, Dict]] = []
         for i, query in enumerate(queries):
             logger.debug(f"Retrieving with query: {query}")
@@ -218,11 +450,13 @@ class ElasticsearchIndexer(DenseIndexer):
             if vec is not None:
                 unit_vec = vec / np.linalg.norm(vec)
                 knn_param = {
-                    "field": "vec",
+                    "field": vec_field,
                     "query_vector": unit_vec,
                     "k": top_k,
                     "num_candidates": top_k * 2,
                 }
+                if inner_hits is not None:
+                    knn_param["inner_hits"] = inner_hits
 
             term_query = (
                 None
@@ -237,17 +471,22 @@ class ElasticsearchIndexer(DenseIndexer):
             )
 
             logger.debug(f"term_query: {term_query}")
-            res = self.es.search(
+            res = es.search(
                 index=self.index_name,
                 knn=knn_param,
                 query=term_query,
-                source=self.fields if source is None else source,
                 from_=from_,
                 size=size,
+                **projection,
             )
+            hits = res["hits"]["hits"]
+            if hydrate:
+                hits = self.hydrate_hits(
+                    hits, source, source_excludes, highlight_only
+                )
             result = {
                 "total": res["hits"]["total"]["value"],
-                "hits": res["hits"]["hits"],
+                "hits": hits,
             }
             logger.debug(f"query {query} retrieved {len(result['hits'])} results.")
             results.append((query, result))
@@ -255,6 +494,99 @@ class ElasticsearchIndexer(DenseIndexer):
             logger.debug(f"Retrieved {len(result)} results.")
         return results
 
+    def query_sparse(
+        self,
+        queries: List[str],
+        term_weights: List[Dict[str, float]],
+        max_query_terms: Optional[int] = None,
+        term_fields: List[str] = [],
+        top_k: int = 10,
+        from_: int = 0,
+        size: int = 10,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+        operator: str = "and",
+        request_timeout: Optional[float] = None,
+        hydrate: bool = True,
+    ) -> List[Tuple[str, Dict]]:
+        """Scores documents by the dot product of query and document term weights.
+
+        Each query term becomes a linear `rank_feature` query on the `sparse`
+        field boosted by its weight.
+
+        Args:
+            queries: The queries.
+            term_weights: The term weights of each query.
+            max_query_terms: Keeps only the heaviest query terms to bound latency.
+            term_fields: If given, a multi_match on these fields is added.
+            request_timeout: The timeout in seconds of each search request.
+            hydrate: If False, the hits are not hydrated from the doc store (see
+                `hydrate_hits`).
+
+        Returns:
+            The results of each query.
+        """
+        if len(term_weights) != len(queries):
+            raise ValueError(
+                "The number of term_weights must be equal to the number of queries."
+            )
+
+        projection = self.create_projection_param(
+            "vec", source, source_excludes, highlight_fields, highlight_only
+        )
+
+        es = self.search_client(request_timeout)
+        results: List[Tuple[str, Dict]] = []
+        for query, weights in zip(queries, term_weights):
+            weights = prune_term_weights(weights, max_query_terms)
+            should: List[Dict] = [
+                {
+                    "rank_feature": {
+                        "field": f"sparse.{term}",
+                        "linear": {},
+                        "boost": weight,
+                    }
+                }
+                for term, weight in weights.items()
+            ]
+            if len(term_fields) > 0:
+                should.append(
+                    {
+                        "multi_match": {
+                            "query": query,
+                            "fields": term_fields,
+                            "operator": operator,
+                        }
+                    }
+                )
+            if len(should) == 0:
+                # an empty bool query would match every document
+                logger.debug(f"query {query} has no usable terms.")
+                results.append((query, {"total": 0, "hits": []}))
+                continue
+
+            res = es.search(
+                index=self.index_name,
+                query={"bool": {"should": should}},
+                from_=from_,
+                size=size,
+                **projection,
+            )
+            hits = res["hits"]["hits"]
+            if hydrate:
+                hits = self.hydrate_hits(
+                    hits, source, source_excludes, highlight_only
+                )
+            result = {
+                "total": res["hits"]["total"]["value"],
+                "hits": hits,
+            }
+            logger.debug(f"query {query} retrieved {len(hits)} results.")
+            results.append((query, result))
+        return results
+
 
 class ElasticsearchBM25(Retriever):
     def __init__(
@@ -265,6 +597,9 @@ class ElasticsearchBM25(Retriever):
         self.es_indexer = es_indexer
         self.fields = fields
 
+    def after_fork(self) -> None:
+        self.es_indexer.after_fork()
+
     def async_index(
         self,
         corpus_loader: CorpusLoader,
@@ -290,6 +625,11 @@ class ElasticsearchBM25(Retriever):
         batch_size: int = 10_000,
         total: int = 65613666,
     ) -> None:
+        if corpus_loader.columnar:
+            for batch in corpus_loader.load_batches(batch_size=batch_size):
+                self.es_indexer.index_batch(batch)
+            return
+
         for docs_chunk in tqdm(
             corpus_loader.load(batch_size=batch_size),
             desc="indexing..",
@@ -308,9 +648,21 @@ class ElasticsearchBM25(Retriever):
         from_: int = 0,
         size: int = 10,
         hybrid: bool = False,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
     ) -> List[Tuple[str, Dict]]:
         fields = self.fields if search_fields is None else search_fields
         result = self.es_indexer.query(
-            queries, term_fields=fields, top_k=top_k, from_=from_, size=size
+            queries,
+            term_fields=fields,
+            top_k=top_k,
+            from_=from_,
+            size=size,
+            source=source,
+            source_excludes=source_excludes,
+            highlight_fields=highlight_fields,
+            highlight_only=highlight_only,
         )
         return result
@@ -0,0 +1,330 @@
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from logging import getLogger
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from .base import DenseIndexer, VecRecord
+
+logger = getLogger(__name__)
+
+
+def hash_partitioner(record: BaseModel, num_shards: int) -> int:
+    """Assigns a record to a shard by the crc32 of its doc_id."""
+    doc = record.doc if isinstance(record, VecRecord) else record
+    return zlib.crc32(str(doc.doc_id).encode("utf-8")) % num_shards
+
+
+def normalize_scores(hits: List[Dict], method: Optional[str]) -> List[Dict]:
+    """Normalizes the `_score` of the hits of one shard in place.
+
+    The original score is kept as `_raw_score`.
+
+    Args:
+        hits: The hits returned by one shard.
+        method: "minmax", "zscore" or None to keep the raw scores.
+
+    Returns:
+        The hits.
+    """
+    if method is None or len(hits) <= 0:
+        return hits
+
+    scores = np.array([hit["_score"] or 0.0 for hit in hits], dtype=np.float64)
+    if method == "minmax":
+        span = scores.max() - scores.min()
+        if span > 0:
+            normalized = (scores - scores.min()) / span
+        else:
+            normalized = np.ones_like(scores)
+    elif method == "zscore":
+        std = scores.std()
+        if std > 0:
+            normalized = (scores - scores.mean()) / std
+        else:
+            normalized = np.zeros_like(scores)
+    else:
+        raise ValueError(f"Normalization method {method} not supported.")
+
+    for hit, score in zip(hits, normalized):
+        hit["_raw_score"] = hit["_score"]
+        hit["_score"] = float(score)
+    return hits
+
+
+class FederatedIndexer(DenseIndexer):
+    """Fans queries out to several indexers and merges their results.
+
+    Each shard is any `DenseIndexer` (an `ElasticsearchIndexer` pointing at another
+    cluster or index, for example). Queries are sent to all the shards
+    concurrently, the top hits of each shard are score-normalized and merged. A
+    shard that does not answer within its timeout is skipped, and the merged
+    result is marked as partial.
+
+    The timeout is also passed to the shard as `request_timeout`, so that a slow
+    shard releases its thread. At most `max_in_flight` queries are running on a
+    shard at once; a query arriving while a shard is saturated skips that shard
+    instead of queueing behind it.
+    """
+
+    def __init__(
+        self,
+        shards: Dict[str, DenseIndexer],
+        timeout: float = 1.0,
+        shard_timeouts: Optional[Dict[str, float]] = None,
+        normalization: Optional[str] = "minmax",
+        partitioner: Callable[[BaseModel, int], int] = hash_partitioner,
+        max_in_flight: int = 4,
+    ) -> None:
+        if len(shards) <= 0:
+            raise ValueError("At least one shard must be given.")
+
+        self.shards = shards
+        self.shard_names = list(shards.keys())
+        self.timeout = timeout
+        self.shard_timeouts = shard_timeouts or {}
+        self.normalization = normalization
+        self.partitioner = partitioner
+        self.max_in_flight = max_in_flight
+        self.create_executor()
+
+    def create_executor(self) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.shards) * self.max_in_flight,
+            thread_name_prefix="fotla-federated",
+        )
+        self.lock = threading.Lock()
+        self.in_flight = {name: 0 for name in self.shard_names}
+
+    def after_fork(self) -> None:
+        self.create_executor()
+        for shard in self.shards.values():
+            shard.after_fork()
+
+    def partition(self, records: Iterable[BaseModel]) -> Dict[str, List[BaseModel]]:
+        partitions: Dict[str, List[BaseModel]] = {
+            name: [] for name in self.shard_names
+        }
+        for record in records:
+            shard_i = self.partitioner(record, len(self.shard_names))
+            partitions[self.shard_names[shard_i]].append(record)
+        return partitions
+
+    def index(self, records: Iterable[BaseModel], **kwargs) -> int:
+        """Indexes the records into the shard chosen by the partitioner.
+
+        Args:
+            records: The records to index.
+
+        Returns:
+            The number of records written to all the shards.
+        """
+        write_count = 0
+        for name, shard_records in self.partition(records).items():
+            if len(shard_records) > 0:
+                write_count += self.shards[name].index(shard_records, **kwargs)
+        return write_count
+
+    def async_index(self, records: Iterable[BaseModel]) -> int:
+        write_count = 0
+        for name, shard_records in self.partition(records).items():
+            if len(shard_records) > 0:
+                write_count += self.shards[name].async_index(shard_records)
+        return write_count
+
+    def hydrate_hits(
+        self,
+        hits: List[Dict],
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Dict]:
+        """Hydrates each hit with the shard it was returned by."""
+        for name, shard in self.shards.items():
+            shard_hits = [hit for hit in hits if hit.get("_shard") == name]
+            if len(shard_hits) > 0:
+                shard.hydrate_hits(
+                    shard_hits, source, source_excludes, highlight_only
+                )
+        return hits
+
+    def release(self, name: str, future: Future) -> None:
+        with self.lock:
+            self.in_flight[name] -= 1
+
+    def query(
+        self,
+        queries: List[str],
+        term_fields: List[str] = [],
+        vectors: List[np.ndarray] = [],
+        vec_field: str = "vec",
+        top_k: int = 10,
+        from_: int = 0,
+        size: int = 10,
+        request_timeout: Optional[float] = None,
+        hydrate: bool = True,
+        **kwargs,
+    ) -> List[Tuple[str, Dict]]:
+        """Queries all the shards concurrently and merges their top hits.
+
+        Every shard returns its first `max(top_k, from_ + size)` hits and the
+        scores are normalized within that window, so the pages inside the first
+        `top_k` hits are cut from the same merged ranking. Normalized scores of
+        different shards are only roughly comparable, so the merged ranking is an
+        approximation of a ranking over a single index.
+
+        The shards do not hydrate their hits from their doc stores. Only the
+        hits of the returned page are hydrated, by the shard they come from.
+
+        Args:
+            request_timeout: If given, caps the timeout of every shard.
+            hydrate: If False, the returned hits are not hydrated either.
+
+        Returns:
+            The merged results per query. Besides "total" and "hits", each result
+            has "partial" and "shards" describing which shards timed out, failed
+            or were skipped because they were saturated.
+        """
+        return self.search_shards(
+            "query",
+            queries,
+            top_k,
+            from_,
+            size,
+            request_timeout,
+            hydrate,
+            term_fields=term_fields,
+            vectors=vectors,
+            vec_field=vec_field,
+            **kwargs,
+        )
+
+    def query_sparse(
+        self,
+        queries: List[str],
+        term_weights: List[Dict[str, float]],
+        max_query_terms: Optional[int] = None,
+        term_fields: List[str] = [],
+        top_k: int = 10,
+        from_: int = 0,
+        size: int = 10,
+        request_timeout: Optional[float] = None,
+        hydrate: bool = True,
+        **kwargs,
+    ) -> List[Tuple[str, Dict]]:
+        """Queries the sparse vectors of all the shards and merges the top hits.
+
+        See `query` for how the hits are merged.
+        """
+        return self.search_shards(
+            "query_sparse",
+            queries,
+            top_k,
+            from_,
+            size,
+            request_timeout,
+            hydrate,
+            term_weights=term_weights,
+            max_query_terms=max_query_terms,
+            term_fields=term_fields,
+            **kwargs,
+        )
+
+    def search_shards(
+        self,
+        method: str,
+        queries: List[str],
+        top_k: int,
+        from_: int,
+        size: int,
+        request_timeout: Optional[float],
+        hydrate: bool,
+        **kwargs,
+    ) -> List[Tuple[str, Dict]]:
+        started = time.monotonic()
+        window = max(top_k, from_ + size)
+        timeouts: Dict[str, float] = {}
+        futures: Dict[str, Future] = {}
+        skipped: List[str] = []
+        for name, shard in self.shards.items():
+            timeout = self.shard_timeouts.get(name, self.timeout)
+            if request_timeout is not None:
+                timeout = min(timeout, request_timeout)
+            timeouts[name] = timeout
+
+            with self.lock:
+                if self.in_flight[name] >= self.max_in_flight:
+                    logger.warning(f"shard {name} is saturated, skipping it.")
+                    skipped.append(name)
+                    continue
+                self.in_flight[name] += 1
+            future = self.executor.submit(
+                getattr(shard, method),
+                queries,
+                top_k=window,
+                from_=0,
+                size=window,
+                request_timeout=timeout,
+                hydrate=False,
+                **kwargs,
+            )
+            future.add_done_callback(partial(self.release, name))
+            futures[name] = future
+
+        shard_results: Dict[str, List[Tuple[str, Dict]]] = {}
+        timed_out: List[str] = []
+        failed: List[str] = []
+        for name, future in futures.items():
+            timeout = timeouts[name]
+            remaining = max(0.0, started + timeout - time.monotonic())
+            try:
+                shard_results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                logger.warning(f"shard {name} timed out after {timeout} sec.")
+                future.cancel()
+                timed_out.append(name)
+            except Exception as e:
+                logger.warning(f"shard {name} failed: {e}")
+                failed.append(name)
+
+        results: List[Tuple[str, Dict]] = []
+        for i, query in enumerate(queries):
+            total = 0
+            merged: List[Dict] = []
+            for name, shard_result in shard_results.items():
+                _, result = shard_result[i]
+                total += result["total"]
+                hits = normalize_scores(list(result["hits"]), self.normalization)
+                for hit in hits:
+                    hit["_shard"] = name
+                merged.extend(hits)
+
+            merged.sort(key=lambda hit: hit["_score"] or 0.0, reverse=True)
+            hits = merged[from_ : from_ + size]
+            if hydrate:
+                hits = self.hydrate_hits(
+                    hits,
+                    kwargs.get("source"),
+                    kwargs.get("source_excludes"),
+                    kwargs.get("highlight_only", False),
+                )
+            result = {
+                "total": total,
+                "hits": hits,
+                "partial": len(shard_results) < len(self.shards),
+                "shards": {
+                    "total": len(self.shards),
+                    "successful": len(shard_results),
+                    "timed_out": timed_out,
+                    "failed": failed,
+                    "skipped": skipped,
+                },
+            }
+            results.append((query, result))
+        return results
@@ -0,0 +1,348 @@
+import json
+import math
+from logging import getLogger
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+
+def quantize(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantizes the token embeddings to int8 with one scale per token.
+
+    Args:
+        embeddings: The (num_tokens, dim) token embeddings.
+
+    Returns:
+        The int8 codes and the float32 scales.
+    """
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+MAX_BLOCK_BYTES = 256 * 2**20
+
+
+def assign_centroids(
+    embeddings: np.ndarray,
+    centroids: np.ndarray,
+    max_block_bytes: int = MAX_BLOCK_BYTES,
+) -> np.ndarray:
+    """Returns the closest centroid of each embedding.
+
+    The similarities are computed for blocks of rows, so that the
+    (rows, num_centroids) similarity matrix never exceeds `max_block_bytes`.
+
+    Args:
+        embeddings: The (num_embeddings, dim) embeddings.
+        centroids: The (num_centroids, dim) centroids.
+        max_block_bytes: The memory cap of a block of similarities.
+
+    Returns:
+        The index of the closest centroid of each embedding.
+    """
+    block_rows = max(1, max_block_bytes // (4 * len(centroids)))
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), block_rows):
+        block = embeddings[start : start + block_rows]
+        similarities = block @ centroids.T
+        assignments[start : start + len(block)] = np.argmax(similarities, axis=1)
+    return assignments
+
+
+def train_centroids(
+    sample: np.ndarray,
+    num_centroids: int,
+    iterations: int = 10,
+    seed: int = 0,
+    max_block_bytes: int = MAX_BLOCK_BYTES,
+) -> np.ndarray:
+    """Trains centroids with spherical k-means.
+
+    Args:
+        sample: The (num_samples, dim) normalized embeddings to cluster.
+        num_centroids: The number of centroids.
+        iterations: The number of k-means iterations.
+        seed: The random seed.
+        max_block_bytes: The memory cap of a block of similarities.
+
+    Returns:
+        The (num_centroids, dim) normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    num_centroids = min(num_centroids, len(sample))
+    centroids = sample[rng.choice(len(sample), num_centroids, replace=False)]
+    for _ in range(iterations):
+        assignments = assign_centroids(sample, centroids, max_block_bytes)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        sums[~empty] /= norms[~empty]
+        # keep the previous centroid for the clusters that got no sample
+        sums[empty] = centroids[empty]
+        centroids = sums
+    return centroids.astype(np.float32)
+
+
+class MultiVectorIndexer(object):
+    """A local late-interaction index of per-token embeddings.
+
+    The token embeddings are stored as memory-mapped int8 codes with one scale per
+    token. `build` clusters them into centroids and writes an inverted list from
+    each centroid to the documents having a token in it. A search probes the
+    closest centroids of every query token to collect candidates, and re-scores
+    only those candidates with exact MaxSim.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        nprobe: int = 4,
+        candidate_size: int = 1024,
+        rescore_chunk_size: int = 256,
+        recreate: bool = False,
+    ) -> None:
+        self.path = Path(path)
+        self.nprobe = nprobe
+        self.candidate_size = candidate_size
+        self.rescore_chunk_size = rescore_chunk_size
+
+        self.meta_path = self.path / "meta.json"
+        self.codes_path = self.path / "codes.bin"
+        self.scales_path = self.path / "scales.bin"
+        self.lengths_path = self.path / "lengths.bin"
+        self.doc_ids_path = self.path / "doc_ids.txt"
+        self.centroids_path = self.path / "centroids.npy"
+        self.ivf_docs_path = self.path / "ivf_docs.npy"
+        self.ivf_offsets_path = self.path / "ivf_offsets.npy"
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        if recreate:
+            for file_path in (
+                self.meta_path,
+                self.codes_path,
+                self.scales_path,
+                self.lengths_path,
+                self.doc_ids_path,
+                self.centroids_path,
+                self.ivf_docs_path,
+                self.ivf_offsets_path,
+            ):
+                if file_path.exists():
+                    file_path.unlink()
+
+        self.dim: Optional[int] = None
+        if self.meta_path.exists():
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+        self.codes: Optional[np.ndarray] = None
+
+    def add(self, doc_ids: List[str], embeddings: List[np.ndarray]) -> int:
+        """Appends the token embeddings of the documents to the index.
+
+        `build` must be called after adding all the documents.
+
+        Args:
+            doc_ids: The doc_ids of the documents.
+            embeddings: The (num_tokens, dim) normalized token embeddings of each
+                document.
+
+        Returns:
+            The number of documents added.
+        """
+        if len(doc_ids) != len(embeddings):
+            raise ValueError("The number of doc_ids and embeddings must be equal.")
+
+        if any(len(emb) <= 0 for emb in embeddings):
+            raise ValueError("Every document must have at least one token.")
+
+        if self.dim is None:
+            self.dim = embeddings[0].shape[1]
+            with open(self.meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+
+        codes, scales = quantize(np.concatenate(embeddings).astype(np.float32))
+        lengths = np.array([len(emb) for emb in embeddings], dtype=np.int64)
+
+        with open(self.codes_path, "ab") as f:
+            codes.tofile(f)
+        with open(self.scales_path, "ab") as f:
+            scales.tofile(f)
+        with open(self.lengths_path, "ab") as f:
+            lengths.tofile(f)
+        with open(self.doc_ids_path, "a") as f:
+            f.writelines(str(doc_id) + "\n" for doc_id in doc_ids)
+
+        self.codes = None
+        return len(doc_ids)
+
+    def load_tokens(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        codes = np.memmap(self.codes_path, dtype=np.int8, mode="r").reshape(
+            -1, self.dim
+        )
+        scales = np.memmap(self.scales_path, dtype=np.float32, mode="r")
+        lengths = np.fromfile(self.lengths_path, dtype=np.int64)
+        return codes, scales, lengths
+
+    def build(
+        self,
+        num_centroids: Optional[int] = None,
+        sample_size: int = 262_144,
+        iterations: int = 10,
+        seed: int = 0,
+        max_block_bytes: int = MAX_BLOCK_BYTES,
+    ) -> None:
+        """Trains the centroids and writes the inverted lists.
+
+        Args:
+            num_centroids: The number of centroids. Defaults to the power of two
+                nearest to 16 * sqrt(num_tokens).
+            sample_size: The number of tokens sampled to train the centroids.
+            iterations: The number of k-means iterations.
+            seed: The random seed.
+            max_block_bytes: The memory cap of a block of tokens and of their
+                similarities to the centroids.
+        """
+        codes, scales, lengths = self.load_tokens()
+        num_tokens = len(codes)
+        if num_centroids is None:
+            num_centroids = 2 ** round(math.log2(16 * math.sqrt(num_tokens)))
+
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(
+            rng.choice(num_tokens, min(sample_size, num_tokens), replace=False)
+        )
+        sample = codes[sample_ids].astype(np.float32) * scales[sample_ids, None]
+        sample /= np.linalg.norm(sample, axis=1, keepdims=True)
+        centroids = train_centroids(
+            sample, num_centroids, iterations, seed, max_block_bytes
+        )
+        del sample
+        logger.info(f"trained {len(centroids)} centroids.")
+
+        chunk_size = max(1, max_block_bytes // (4 * (len(centroids) + self.dim)))
+        token_centroids = np.empty(num_tokens, dtype=np.int32)
+        for start in range(0, num_tokens, chunk_size):
+            end = min(start + chunk_size, num_tokens)
+            tokens = codes[start:end].astype(np.float32) * scales[start:end, None]
+            token_centroids[start:end] = assign_centroids(
+                tokens, centroids, max_block_bytes
+            )
+
+        num_docs = len(lengths)
+        token_docs = np.repeat(np.arange(num_docs, dtype=np.int64), lengths)
+        pairs = np.unique(token_centroids.astype(np.int64) * num_docs + token_docs)
+        ivf_centroids, ivf_docs = np.divmod(pairs, num_docs)
+        ivf_offsets = np.searchsorted(ivf_centroids, np.arange(len(centroids) + 1))
+
+        np.save(self.centroids_path, centroids)
+        np.save(self.ivf_docs_path, ivf_docs.astype(np.int32))
+        np.save(self.ivf_offsets_path, ivf_offsets.astype(np.int64))
+        self.codes = None
+
+    def open(self) -> None:
+        """Memory-maps the index for searching."""
+        self.codes, self.scales, lengths = self.load_tokens()
+        self.doc_offsets = np.concatenate(
+            [np.zeros(1, dtype=np.int64), np.cumsum(lengths)]
+        )
+        self.centroids = np.load(self.centroids_path)
+        self.ivf_docs = np.load(self.ivf_docs_path, mmap_mode="r")
+        self.ivf_offsets = np.load(self.ivf_offsets_path)
+        with open(self.doc_ids_path) as f:
+            self.doc_ids = [line.rstrip("\n") for line in f]
+
+    def generate_candidates(self, query: np.ndarray) -> np.ndarray:
+        """Collects the documents sharing a probed centroid with the query.
+
+        When there are more than `candidate_size` documents, the ones hit by the
+        most probes are kept.
+
+        Args:
+            query: The (num_query_tokens, dim) query token embeddings.
+
+        Returns:
+            The rows of the candidate documents.
+        """
+        centroid_scores = query @ self.centroids.T
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        probes = probes.ravel()
+        starts, ends = self.ivf_offsets[probes], self.ivf_offsets[probes + 1]
+        if ends.sum() - starts.sum() <= 0:
+            return np.empty(0, dtype=np.int64)
+        docs = np.concatenate([self.ivf_docs[s:e] for s, e in zip(starts, ends)])
+
+        candidates, counts = np.unique(docs, return_counts=True)
+        if len(candidates) > self.candidate_size:
+            keep = np.argpartition(-counts, self.candidate_size - 1)
+            candidates = np.sort(candidates[keep[: self.candidate_size]])
+        return candidates.astype(np.int64)
+
+    def maxsim(self, query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Scores the candidates with the sum over query tokens of the MaxSim.
+
+        The tokens of `rescore_chunk_size` candidates at a time are gathered into
+        one matrix, so that the similarities are computed with a single matrix
+        product and reduced per document with `np.maximum.reduceat`.
+
+        Args:
+            query: The (num_query_tokens, dim) query token embeddings.
+            candidates: The rows of the candidate documents.
+
+        Returns:
+            The scores of the candidates.
+        """
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for i in range(0, len(candidates), self.rescore_chunk_size):
+            chunk = candidates[i : i + self.rescore_chunk_size]
+            starts = self.doc_offsets[chunk]
+            lengths = self.doc_offsets[chunk + 1] - starts
+            segments = np.concatenate(
+                [np.zeros(1, dtype=np.int64), np.cumsum(lengths)]
+            )
+            token_ids = np.arange(segments[-1]) + np.repeat(
+                starts - segments[:-1], lengths
+            )
+
+            tokens = self.codes[token_ids].astype(np.float32)
+            tokens *= self.scales[token_ids, None]
+            similarities = query @ tokens.T
+            maxsims = np.maximum.reduceat(similarities, segments[:-1], axis=1)
+            scores[i : i + len(chunk)] = maxsims.sum(axis=0)
+        return scores
+
+    def search(
+        self, query: np.ndarray, top_k: int = 10
+    ) -> Tuple[List[str], np.ndarray, int]:
+        """Returns the top_k documents for the query token embeddings.
+
+        Args:
+            query: The (num_query_tokens, dim) query token embeddings.
+            top_k: The number of documents to return.
+
+        Returns:
+            The doc_ids and scores of the top_k documents, and the number of
+            candidates they were selected from.
+        """
+        if self.codes is None:
+            self.open()
+
+        query = query.astype(np.float32)
+        candidates = self.generate_candidates(query)
+        if len(candidates) <= 0:
+            return [], np.empty(0, dtype=np.float32), 0
+
+        scores = self.maxsim(query, candidates)
+        top_k = min(top_k, len(candidates))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        doc_ids = [self.doc_ids[row] for row in candidates[top]]
+        return doc_ids, scores[top], len(candidates)
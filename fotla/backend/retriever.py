@@ -1,13 +1,15 @@
 import abc
 from logging import getLogger
-from typing import Callable, Iterable, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 from pydantic import BaseModel
 
-from fotla.backend.corpus_loader import CorpusLoader, Doc
-from fotla.backend.encoder import DenseEncoder
-from fotla.backend.indexer import DenseIndexer, VecRecord
+from fotla.backend.chunker import PassageChunker
+from fotla.backend.corpus_loader import CorpusLoader, Doc, DocBatch
+from fotla.backend.docstore import DocStore
+from fotla.backend.encoder import DenseEncoder, MultiVectorEncoder, SparseEncoder
+from fotla.backend.indexer import DenseIndexer, MultiVectorIndexer, VecRecord
 
 logger = getLogger(__name__)
 
@@ -21,6 +23,12 @@ class Retriever(abc.ABC):
     def retrieve(self, queries: List[str], top_k: int) -> List[Tuple]:
         raise NotImplementedError
 
+    def after_fork(self) -> None:
+        """Re-creates the resources that must not be shared with the parent process.
+
+        Called in each worker process forked by the multi-worker API server.
+        """
+
 
 def docs_to_texts(docs: Iterable[Doc]) -> Tuple[List[str], List[str]]:
     # docids = []
@@ -31,6 +39,10 @@ def docs_to_texts(docs: Iterable[Doc]) -> Tuple[List[str], List[str]]:
     return texts
 
 
+def batch_to_texts(batch: DocBatch) -> List[str]:
+    return [text + " " + title for text, title in zip(batch.texts, batch.titles)]
+
+
 class DenseRetriever(Retriever):
     def __init__(
         self,
@@ -39,10 +51,15 @@ class DenseRetriever(Retriever):
         model_to_texts: Callable[
             [Iterable[BaseModel]], Tuple[List[str], List[str]]
         ] = docs_to_texts,
+        batch_to_texts: Callable[[DocBatch], List[str]] = batch_to_texts,
     ) -> None:
         self.encoder = encoder
         self.vector_indexer = vector_indexer
         self.model_to_texts = model_to_texts
+        self.batch_to_texts = batch_to_texts
+
+    def after_fork(self) -> None:
+        self.vector_indexer.after_fork()
 
     def encode_docs(self, models: Iterable[BaseModel]) -> np.ndarray:
         texts = self.model_to_texts(models)
@@ -70,6 +87,9 @@ class DenseRetriever(Retriever):
         corpus_loader: CorpusLoader,
         batch_size: int = 10_000,
     ) -> None:
+        if corpus_loader.columnar:
+            return self.index_batches(corpus_loader, batch_size=batch_size)
+
         def yield_doc_vector(embs: np.ndarray, docs_chunk: List[BaseModel]):
             for emb, doc in zip(embs, docs_chunk):
                 yield VecRecord(vec=emb, doc=doc)
@@ -83,6 +103,17 @@ class DenseRetriever(Retriever):
             write_total += write_count
         logger.info(f"Indexed {write_total} documents.")
 
+    def index_batches(
+        self,
+        corpus_loader: CorpusLoader,
+        batch_size: int = 10_000,
+    ) -> None:
+        write_total = 0
+        for batch in corpus_loader.load_batches(batch_size=batch_size):
+            embeddings = self.encoder.encode_corpus(self.batch_to_texts(batch))
+            write_total += self.vector_indexer.index_batch(batch, embeddings)
+        logger.info(f"Indexed {write_total} documents.")
+
     def retrieve(
         self,
         queries: List[str],
@@ -91,6 +122,10 @@ class DenseRetriever(Retriever):
         from_: int = 0,
         size: int = 10,
         hybrid: bool = False,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
     ) -> List[Tuple]:
         embeddings = self.encode_queries(queries)
         logger.info(f"retrieving with {len(queries)} queries, hybrid={hybrid}")
@@ -102,4 +137,297 @@ class DenseRetriever(Retriever):
             top_k=top_k,
             from_=from_,
             size=size,
+            source=source,
+            source_excludes=source_excludes,
+            highlight_fields=highlight_fields,
+            highlight_only=highlight_only,
         )
+
+
+class PassageDenseRetriever(DenseRetriever):
+    """Indexes long documents as overlapping passages under their parent doc.
+
+    Each document is split by `chunker`, all the passages are encoded (sorted by
+    length so that batches are padded as little as possible), and the passage
+    vectors are indexed as nested vectors of the document (see
+    `mappings_passage.json`). A query scores each document by its best passage
+    ("max"), or by the sum of its `agg_k` best passages ("topk_sum").
+    """
+
+    def __init__(
+        self,
+        encoder: DenseEncoder,
+        vector_indexer: DenseIndexer,
+        chunker: PassageChunker,
+        aggregation: str = "max",
+        agg_k: int = 3,
+        model_to_texts: Callable[
+            [Iterable[BaseModel]], Tuple[List[str], List[str]]
+        ] = docs_to_texts,
+    ) -> None:
+        if aggregation not in ("max", "topk_sum"):
+            raise ValueError(f"Aggregation {aggregation} not supported.")
+
+        super().__init__(encoder, vector_indexer, model_to_texts=model_to_texts)
+        self.chunker = chunker
+        self.aggregation = aggregation
+        self.agg_k = agg_k
+
+    def encode_passages(self, passages: List[str]) -> np.ndarray:
+        order = np.argsort([len(passage) for passage in passages], kind="stable")
+        embeddings = self.encoder.encode_corpus([passages[i] for i in order])
+        unsorted = np.empty_like(embeddings)
+        unsorted[order] = embeddings
+        return unsorted
+
+    def yield_passage_records(
+        self, docs_chunk: List[BaseModel]
+    ) -> Iterator[VecRecord]:
+        passages, parents = self.chunker.chunk(self.model_to_texts(docs_chunk))
+        embeddings = self.encode_passages(passages)
+        num_docs, num_passages = len(docs_chunk), len(passages)
+        logger.debug(f"Split {num_docs} docs into {num_passages} passages.")
+
+        # the passages of each document are contiguous, in document order
+        boundaries = np.searchsorted(parents, np.arange(len(docs_chunk) + 1))
+        for doc, start, end in zip(docs_chunk, boundaries, boundaries[1:]):
+            yield VecRecord(vec=embeddings[start:end], doc=doc)
+
+    def async_index(
+        self, corpus_loader: CorpusLoader, batch_size: int = 10_000
+    ) -> None:
+        write_total = 0
+        for docs_chunk in corpus_loader.load(batch_size=batch_size):
+            records = self.yield_passage_records(docs_chunk)
+            write_total += self.vector_indexer.async_index(records)
+        logger.info(f"Indexed {write_total} documents.")
+
+    def index(
+        self,
+        corpus_loader: CorpusLoader,
+        batch_size: int = 10_000,
+    ) -> None:
+        write_total = 0
+        for docs_chunk in corpus_loader.load(batch_size=batch_size):
+            records = self.yield_passage_records(docs_chunk)
+            write_total += self.vector_indexer.index(records)
+        logger.info(f"Indexed {write_total} documents.")
+
+    def aggregate_topk_sum(self, hits: List[Dict]) -> List[Dict]:
+        """Adds the scores of the other top passages to the score of each hit.
+
+        The knn part of `_score` is the score of the best passage, so adding the
+        others keeps the term query part of a hybrid score. Hits without inner
+        hits keep their score.
+        """
+        for hit in hits:
+            inner_hits = hit.get("inner_hits", {}).get("passages", {})
+            passage_hits = inner_hits.get("hits", {}).get("hits", [])
+            scores = [passage["_score"] or 0.0 for passage in passage_hits]
+            if len(scores) > 0:
+                hit["_score"] = (hit["_score"] or 0.0) + sum(scores) - max(scores)
+        return sorted(hits, key=lambda hit: hit["_score"] or 0.0, reverse=True)
+
+    def retrieve(
+        self,
+        queries: List[str],
+        top_k: int,
+        search_fields: Optional[List[str]] = None,
+        from_: int = 0,
+        size: int = 10,
+        hybrid: bool = False,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Tuple]:
+        embeddings = self.encode_queries(queries)
+        logger.info(f"retrieving with {len(queries)} queries, hybrid={hybrid}")
+
+        # ES aggregates nested knn by the max passage score. For topk_sum, the
+        # agg_k best passages of the top_k documents are fetched and re-scored,
+        # and only the returned page is hydrated.
+        topk_sum = self.aggregation == "topk_sum"
+        source_excludes = ["passages"] + (source_excludes or [])
+        results = self.vector_indexer.query(
+            queries,
+            term_fields=search_fields if hybrid else [],
+            vectors=embeddings,
+            vec_field="passages.vec",
+            top_k=top_k,
+            from_=0 if topk_sum else from_,
+            size=max(top_k, from_ + size) if topk_sum else size,
+            source=source,
+            source_excludes=source_excludes,
+            highlight_fields=highlight_fields,
+            highlight_only=highlight_only,
+            inner_hits={"size": self.agg_k, "_source": False} if topk_sum else None,
+            hydrate=not topk_sum,
+        )
+        if not topk_sum:
+            return results
+
+        for _, result in results:
+            hits = self.aggregate_topk_sum(result["hits"])
+            for hit in hits:
+                hit.pop("inner_hits", None)
+            result["hits"] = self.vector_indexer.hydrate_hits(
+                hits[from_ : from_ + size], source, source_excludes, highlight_only
+            )
+        return results
+
+
+class SparseRetriever(Retriever):
+    """Retrieves with learned sparse term weights (SPLADE-style).
+
+    The documents are indexed as `rank_features`, and the query terms are pruned
+    to the `max_query_terms` heaviest ones at query time to bound the latency.
+    """
+
+    def __init__(
+        self,
+        encoder: SparseEncoder,
+        vector_indexer: DenseIndexer,
+        model_to_texts: Callable[
+            [Iterable[BaseModel]], Tuple[List[str], List[str]]
+        ] = docs_to_texts,
+        max_query_terms: Optional[int] = 32,
+    ) -> None:
+        self.encoder = encoder
+        self.vector_indexer = vector_indexer
+        self.model_to_texts = model_to_texts
+        self.max_query_terms = max_query_terms
+
+    def after_fork(self) -> None:
+        self.vector_indexer.after_fork()
+
+    def index(
+        self,
+        corpus_loader: CorpusLoader,
+        batch_size: int = 10_000,
+    ) -> None:
+        write_total = 0
+        for docs_chunk in corpus_loader.load(batch_size=batch_size):
+            term_weights = self.encoder.encode_corpus(self.model_to_texts(docs_chunk))
+            write_total += self.vector_indexer.index(
+                VecRecord(doc=doc, sparse=weights)
+                for doc, weights in zip(docs_chunk, term_weights)
+            )
+        logger.info(f"Indexed {write_total} documents.")
+
+    def retrieve(
+        self,
+        queries: List[str],
+        top_k: int,
+        search_fields: Optional[List[str]] = None,
+        from_: int = 0,
+        size: int = 10,
+        hybrid: bool = False,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Tuple[str, Dict]]:
+        term_weights = self.encoder.encode_queries(queries)
+        logger.info(f"retrieving with {len(queries)} queries, hybrid={hybrid}")
+
+        return self.vector_indexer.query_sparse(
+            queries,
+            term_weights,
+            max_query_terms=self.max_query_terms,
+            term_fields=search_fields if hybrid and search_fields else [],
+            top_k=top_k,
+            from_=from_,
+            size=size,
+            source=source,
+            source_excludes=source_excludes,
+            highlight_fields=highlight_fields,
+            highlight_only=highlight_only,
+        )
+
+
+class LateInteractionRetriever(Retriever):
+    """Retrieves with per-token embeddings and MaxSim scoring (ColBERT-style).
+
+    Hits are returned in the same shape as the Elasticsearch backed retrievers.
+    Their `_source` is hydrated from `doc_store` if given.
+    """
+
+    def __init__(
+        self,
+        encoder: MultiVectorEncoder,
+        indexer: MultiVectorIndexer,
+        doc_store: Optional[DocStore] = None,
+        batch_to_texts: Callable[[DocBatch], List[str]] = batch_to_texts,
+    ) -> None:
+        self.encoder = encoder
+        self.indexer = indexer
+        self.doc_store = doc_store
+        self.batch_to_texts = batch_to_texts
+
+    def encode_queries(self, queries: Iterable[str]) -> List[np.ndarray]:
+        return self.encoder.encode_queries(queries)
+
+    def index(
+        self,
+        corpus_loader: CorpusLoader,
+        batch_size: int = 10_000,
+    ) -> None:
+        write_total = 0
+        for batch in corpus_loader.load_batches(batch_size=batch_size):
+            embeddings = self.encoder.encode_corpus(self.batch_to_texts(batch))
+            write_total += self.indexer.add(batch.doc_ids, embeddings)
+            if self.doc_store is not None:
+                self.doc_store.write_batch(batch)
+
+        self.indexer.build()
+        logger.info(f"Indexed {write_total} documents.")
+
+    def retrieve(
+        self,
+        queries: List[str],
+        top_k: int,
+        search_fields: Optional[List[str]] = None,
+        from_: int = 0,
+        size: int = 10,
+        hybrid: bool = False,
+        source: Optional[List[str]] = None,
+        source_excludes: Optional[List[str]] = None,
+        highlight_fields: Optional[List[str]] = None,
+        highlight_only: bool = False,
+    ) -> List[Tuple[str, Dict]]:
+        """Retrieves the top_k documents by MaxSim and returns the requested page.
+
+        There is no term index, so `search_fields` and `hybrid` have no effect,
+        and highlighting is rejected. "total" is the number of candidates the
+        documents were ranked from.
+        """
+        if highlight_fields is not None or highlight_only:
+            raise ValueError("LateInteractionRetriever does not support highlight.")
+
+        embeddings = self.encode_queries(queries)
+
+        results: List[Tuple[str, Dict]] = []
+        for query, embedding in zip(queries, embeddings):
+            doc_ids, scores, total = self.indexer.search(
+                embedding, top_k=max(top_k, from_ + size)
+            )
+            doc_ids = doc_ids[from_ : from_ + size]
+            scores = scores[from_ : from_ + size]
+
+            hits = [
+                {"_id": doc_id, "_score": float(score), "_source": {"doc_id": doc_id}}
+                for doc_id, score in zip(doc_ids, scores)
+            ]
+            if self.doc_store is not None:
+                stored_docs = self.doc_store.get_many(doc_ids)
+                for hit, stored in zip(hits, stored_docs):
+                    for field, value in (stored or {}).items():
+                        if source is not None and field not in source:
+                            continue
+                        if source_excludes is None or field not in source_excludes:
+                            hit["_source"][field] = value
+
+            result = {"total": total, "hits": hits}
+            results.append((query, result))
+        return results
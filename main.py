@@ -1,7 +1,18 @@
 import os
 
 from fotla.backend.api import start_api
-from fotla.backend.corpus_loader import AdhocCorpusLoader, Doc, JsonlCorpusLoader
+from fotla.backend.corpus_loader import (
+    AdhocCorpusLoader,
+    Doc,
+    JsonlCorpusLoader,
+    ParquetCorpusLoader,
+)
+from fotla.backend.embedding_store import (
+    EmbeddingShardReader,
+    EmbeddingShardWriter,
+    export_embeddings,
+    import_embeddings,
+)
 from fotla.backend.encoder import HFSymetricDenseEncoder
 from fotla.backend.indexer.elasticsearch import (
     ElasticsearchBM25,
@@ -58,7 +69,35 @@ def index(retriever):
     # retriever.async_index(corpus_loader)
 
 
+def load_corpus(path: str):
+    if path.endswith(".jsonl"):
+        return JsonlCorpusLoader(path)
+    return ParquetCorpusLoader(path)
+
+
+def encode(args):
+    encoder = HFSymetricDenseEncoder(args.model, device=args.device)
+    writer = EmbeddingShardWriter(
+        args.output, shard_size=args.shard_size, dtype=args.dtype
+    )
+    export_embeddings(
+        encoder, load_corpus(args.corpus), writer, batch_size=args.batch_size
+    )
+
+
+def load(args):
+    indexer = load_indexer(args.recreate_index)
+    reader = EmbeddingShardReader(args.embeddings)
+    corpus_loader = load_corpus(args.corpus) if args.corpus else None
+    import_embeddings(indexer, reader, corpus_loader, batch_size=args.batch_size)
+
+
 def main(args):
+    if args.command == "encode":
+        return encode(args)
+    if args.command == "load":
+        return load(args)
+
     indexer = load_indexer(args.recreate_index)
     retriever = load_retirever(indexer)
 
@@ -69,7 +108,7 @@ def main(args):
         results = retriever.retrieve([args.retrieve], 100)
         print(results)
     else:
-        start_api(retriever, port=9999)
+        start_api(retriever, port=9999, workers=args.workers)
 
 
 def parse_args():
@@ -79,6 +118,28 @@ def parse_args():
     parser.add_argument("--index", action="store_true")
     parser.add_argument("--retrieve", default="")
     parser.add_argument("--recreate_index", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+
+    subparsers = parser.add_subparsers(dest="command")
+    encode_parser = subparsers.add_parser(
+        "encode", help="encode a corpus into sharded embedding files"
+    )
+    encode_parser.add_argument("--corpus", required=True)
+    encode_parser.add_argument("--output", required=True)
+    encode_parser.add_argument("--model", default="facebook/mcontriever-msmarco")
+    encode_parser.add_argument("--device", default="cuda:0")
+    encode_parser.add_argument("--shard_size", type=int, default=100_000)
+    encode_parser.add_argument(
+        "--dtype", choices=["float16", "float32"], default="float16"
+    )
+    encode_parser.add_argument("--batch_size", type=int, default=10_000)
+
+    load_parser = subparsers.add_parser(
+        "load", help="index precomputed embedding shards"
+    )
+    load_parser.add_argument("--embeddings", required=True)
+    load_parser.add_argument("--corpus", default="")
+    load_parser.add_argument("--batch_size", type=int, default=10_000)
     return parser.parse_args()
 
 
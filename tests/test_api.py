@@ -0,0 +1,207 @@
+"""Tests for `fotla.backend.api`."""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import types
+import urllib.request
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fotla.backend.api import bind_socket, check_fork_safety, load_fastapi_app
+from fotla.backend.retriever import Retriever
+
+WORKER_SCRIPT = """
+import os
+import sys
+
+from fotla.backend.api import load_fastapi_app, start_forked_workers
+from fotla.backend.retriever import Retriever
+
+
+class FakeRetriever(Retriever):
+    def index(self, corpus):
+        pass
+
+    def after_fork(self):
+        if os.environ.get("FAIL_AFTER_FORK"):
+            raise RuntimeError("after_fork failed")
+
+    def retrieve(self, queries, top_k, **kwargs):
+        hit = {"_id": str(os.getpid()), "_score": 1.0}
+        return [(query, {"total": 1, "hits": [hit]}) for query in queries]
+
+
+retriever = FakeRetriever()
+app = load_fastapi_app(retriever)
+start_forked_workers(app, retriever, "127.0.0.1", int(sys.argv[1]), workers=2)
+print(f"returned from {os.getpid()}", flush=True)
+"""
+
+
+class FakeRetriever(Retriever):
+    def __init__(self):
+        self.calls = []
+
+    def index(self, corpus):
+        pass
+
+    def retrieve(self, queries, top_k, highlight_fields=None, **kwargs):
+        self.calls.append(queries)
+        if highlight_fields is not None:
+            raise ValueError("highlight is not supported.")
+        return [
+            (
+                query,
+                {
+                    "total": len(query),
+                    "hits": [{"_id": f"{query}-{i}"} for i in range(len(query))],
+                },
+            )
+            for query in queries
+        ]
+
+
+def create_client(retriever):
+    return TestClient(load_fastapi_app(retriever))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(tmp_path, port, env=None):
+    script = tmp_path / "serve.py"
+    script.write_text(WORKER_SCRIPT)
+    root = str(Path(__file__).resolve().parents[1])
+    env = dict(os.environ, PYTHONPATH=root, **(env or {}))
+    return subprocess.Popen(
+        [sys.executable, str(script), str(port)],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+
+
+def search(port):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/search",
+        data=json.dumps({"query": "q"}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+
+def test_check_fork_safety(monkeypatch):
+    def fake_torch(initialized):
+        cuda = types.SimpleNamespace(is_initialized=lambda: initialized)
+        return types.SimpleNamespace(cuda=cuda)
+
+    monkeypatch.setitem(sys.modules, "torch", fake_torch(False))
+    check_fork_safety()
+    monkeypatch.setitem(sys.modules, "torch", fake_torch(True))
+    with pytest.raises(RuntimeError):
+        check_fork_safety()
+
+
+def test_bind_socket():
+    sock = bind_socket("127.0.0.1", 0)
+    try:
+        assert sock.family == socket.AF_INET
+        assert sock.get_inheritable()
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR) != 0
+        assert sock.getsockname()[1] > 0
+    finally:
+        sock.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_forked_workers_serve_and_stop(tmp_path):
+    port = free_port()
+    process = start_server(tmp_path, port)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                result = search(port)
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise
+                time.sleep(0.1)
+
+        [[query, hits]] = result["result"]
+        assert query == "q"
+        assert int(hits["hits"][0]["_id"]) != process.pid
+    finally:
+        process.send_signal(signal.SIGTERM)
+        stdout, _ = process.communicate(timeout=30)
+
+    assert process.returncode == 0
+    # only the parent returns from start_forked_workers
+    returned = [line for line in stdout.splitlines() if line.startswith("returned")]
+    assert returned == [f"returned from {process.pid}"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_workers_crashing_on_startup_stop_the_server(tmp_path):
+    process = start_server(tmp_path, free_port(), env={"FAIL_AFTER_FORK": "1"})
+    try:
+        stdout, _ = process.communicate(timeout=30)
+    finally:
+        process.kill()
+
+    assert process.returncode != 0
+    assert "returned" not in stdout
+
+
+def test_search_stream_framing():
+    client = create_client(FakeRetriever())
+    response = client.post("/search/stream", json={"queries": ["ab", "", "c"]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"query": "ab", "total": 2},
+        {"query": "ab", "hit": {"_id": "ab-0"}},
+        {"query": "ab", "hit": {"_id": "ab-1"}},
+        {"query": "", "total": 0},
+        {"query": "c", "total": 1},
+        {"query": "c", "hit": {"_id": "c-0"}},
+    ]
+
+
+def test_search_stream_single_query():
+    client = create_client(FakeRetriever())
+    response = client.post("/search/stream", json={"query": "x"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"query": "x", "total": 1},
+        {"query": "x", "hit": {"_id": "x-0"}},
+    ]
+
+
+def test_bad_requests_return_400():
+    retriever = FakeRetriever()
+    client = create_client(retriever)
+
+    response = client.post("/search/stream", json={})
+    assert response.status_code == 422
+    response = client.post("/search", json={"query": "q", "highlight_only": True})
+    assert response.status_code == 422
+    assert retriever.calls == []
+
+    body = {"query": "q", "highlight_fields": ["text"]}
+    assert client.post("/search", json=body).status_code == 400
+    assert client.post("/search/stream", json=body).status_code == 400
@@ -0,0 +1,186 @@
+"""Tests for `fotla.backend.indexer.bulk`."""
+
+import asyncio
+import json
+
+import elasticsearch
+import pytest
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+
+from fotla.backend.indexer import bulk
+from fotla.backend.indexer.bulk import AsyncBulkConfig, AsyncBulkIndexer
+
+
+def api_error(status):
+    meta = ApiResponseMeta(
+        status=status,
+        http_version="1.1",
+        headers=HttpHeaders(),
+        duration=0.0,
+        node=NodeConfig("http", "localhost", 9200),
+    )
+    return elasticsearch.ApiError(f"status {status}", meta=meta, body={})
+
+
+class FakeClient(object):
+    """Answers bulk requests with the responses returned by `respond`."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    async def bulk(self, operations):
+        docs = operations[1::2]
+        self.requests.append(docs)
+        await asyncio.sleep(0)
+        result = self.respond(docs, len(self.requests))
+        if isinstance(result, Exception):
+            raise result
+        items = [{"index": {"status": status}} for status in result]
+        return {"items": items}
+
+
+def run(monkeypatch, respond, actions, **config):
+    client = FakeClient(respond)
+    monkeypatch.setattr(
+        bulk.elasticsearch, "AsyncElasticsearch", lambda *args, **kwargs: client
+    )
+    config = AsyncBulkConfig(initial_backoff=0.0, **config)
+    indexer = AsyncBulkIndexer("http://localhost:9200", config)
+    write_count = asyncio.run(asyncio.wait_for(indexer.run(actions), timeout=10))
+    return indexer, client, write_count
+
+
+def create_actions(num_docs):
+    return [
+        {"_index": "test", "_id": str(i), "_source": {"doc_id": str(i)}}
+        for i in range(num_docs)
+    ]
+
+
+def test_run_indexes_all_documents(monkeypatch):
+    indexer, client, write_count = run(
+        monkeypatch,
+        lambda docs, _: [201] * len(docs),
+        create_actions(25),
+        batch_size=4,
+        concurrency=3,
+    )
+    assert write_count == 25
+    assert indexer.failed_count == 0
+    indexed = sorted(doc["doc_id"] for docs in client.requests for doc in docs)
+    assert indexed == sorted(str(i) for i in range(25))
+
+
+def test_rejected_documents_are_retried(monkeypatch):
+    def respond(docs, request_i):
+        if request_i == 1:
+            return [201, 429, 503]
+        if request_i == 2:
+            return elasticsearch.ConnectionError("down")
+        return [201] * len(docs)
+
+    indexer, client, write_count = run(
+        monkeypatch, respond, create_actions(3), batch_size=10, concurrency=1
+    )
+    assert write_count == 3
+    assert [[doc["doc_id"] for doc in docs] for docs in client.requests] == [
+        ["0", "1", "2"],
+        ["1", "2"],
+        ["1", "2"],
+    ]
+
+
+def test_failed_documents_are_dead_lettered(monkeypatch, tmp_path):
+    dead_letter_path = tmp_path / "dead_letter.jsonl"
+
+    def respond(docs, request_i):
+        if docs[0]["doc_id"] == "0":
+            return [400] + [201] * (len(docs) - 1)
+        if docs[0]["doc_id"] == "2":
+            return api_error(400)
+        return [429] * len(docs)
+
+    indexer, _, write_count = run(
+        monkeypatch,
+        respond,
+        create_actions(6),
+        batch_size=2,
+        concurrency=1,
+        max_retries=2,
+        dead_letter_path=str(dead_letter_path),
+    )
+    assert write_count == 1
+    assert indexer.failed_count == 5
+    with open(dead_letter_path) as f:
+        lines = [json.loads(line) for line in f]
+    dead_ids = sorted(line["action"]["_id"] for line in lines)
+    assert dead_ids == ["0", "2", "3", "4", "5"]
+
+
+def test_serialization_error_is_dead_lettered(monkeypatch):
+    def respond(docs, _):
+        if any(doc["doc_id"] == "1" for doc in docs):
+            return elasticsearch.SerializationError("cannot serialize")
+        return [201] * len(docs)
+
+    indexer, client, write_count = run(
+        monkeypatch, respond, create_actions(4), batch_size=2, concurrency=2
+    )
+    assert write_count == 2
+    assert indexer.failed_count == 2
+    assert len(client.requests) == 2
+
+
+def test_too_large_batch_is_split(monkeypatch):
+    def respond(docs, _):
+        if len(docs) > 2:
+            return api_error(413)
+        return [201] * len(docs)
+
+    indexer, client, write_count = run(
+        monkeypatch, respond, create_actions(7), batch_size=7, concurrency=1
+    )
+    assert write_count == 7
+    assert indexer.failed_count == 0
+    assert indexer.batch_size <= 3
+    # 7 -> 3 + 4 -> (1 + 2) + (2 + 2)
+    assert [len(docs) for docs in client.requests] == [7, 3, 1, 2, 4, 2, 2]
+
+
+def test_too_large_document_is_dead_lettered(monkeypatch):
+    def respond(docs, _):
+        if any(doc["doc_id"] == "0" for doc in docs):
+            return api_error(413)
+        return [201] * len(docs)
+
+    indexer, _, write_count = run(
+        monkeypatch, respond, create_actions(4), batch_size=4, concurrency=1
+    )
+    assert write_count == 3
+    assert indexer.failed_count == 1
+
+
+def test_worker_crash_does_not_hang(monkeypatch):
+    def respond(docs, _):
+        raise KeyError("unexpected")
+
+    with pytest.raises(KeyError):
+        run(monkeypatch, respond, create_actions(100), batch_size=1, concurrency=2)
+
+
+def test_worker_crash_while_sending_sentinels(monkeypatch):
+    def respond(docs, request_i):
+        if request_i == 2:
+            raise KeyError("unexpected")
+        return [201] * len(docs)
+
+    # both batches fit into the queue, so the crash happens during shutdown
+    with pytest.raises(KeyError):
+        run(monkeypatch, respond, create_actions(2), batch_size=1, concurrency=2)
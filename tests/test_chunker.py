@@ -0,0 +1,68 @@
+"""Tests for `fotla.backend.chunker`."""
+
+import pytest
+
+from fotla.backend.chunker import PassageChunker
+
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+
+def create_tokenizer():
+    words = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"] + [f"w{i}" for i in range(100)]
+    model = tokenizers.models.WordLevel(
+        {word: i for i, word in enumerate(words)}, unk_token="[UNK]"
+    )
+    tokenizer = tokenizers.Tokenizer(model)
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="[UNK]",
+        pad_token="[PAD]",
+        cls_token="[CLS]",
+        sep_token="[SEP]",
+        model_max_length=512,
+    )
+
+
+def word_offsets(num_words, width=3):
+    return [(i * (width + 1), i * (width + 1) + width) for i in range(num_words)]
+
+
+def test_chunk_offsets_short_text():
+    chunker = PassageChunker(create_tokenizer(), max_tokens=4, overlap=1)
+    assert chunker.chunk_offsets(word_offsets(4), 20) == [(0, 20)]
+    assert chunker.chunk_offsets([], 0) == [(0, 0)]
+
+
+def test_chunk_offsets_windows_overlap():
+    chunker = PassageChunker(create_tokenizer(), max_tokens=4, overlap=1)
+    offsets = word_offsets(10)
+    spans = chunker.chunk_offsets(offsets, 39)
+
+    # windows of tokens [0, 4), [3, 7), [6, 10)
+    assert spans == [(0, 15), (12, 27), (24, 39)]
+
+
+def test_chunk_offsets_last_window_is_shorter():
+    chunker = PassageChunker(create_tokenizer(), max_tokens=4, overlap=0)
+    spans = chunker.chunk_offsets(word_offsets(9), 35)
+    assert spans == [(0, 15), (16, 31), (32, 35)]
+
+
+def test_chunk_returns_substrings_and_parents():
+    chunker = PassageChunker(create_tokenizer(), max_tokens=3, overlap=1)
+    texts = ["w1 w2", "w1 w2 w3 w4 w5", ""]
+    passages, parents = chunker.chunk(texts)
+    assert passages == ["w1 w2", "w1 w2 w3", "w3 w4 w5", ""]
+    assert parents == [0, 1, 1, 2]
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        PassageChunker(create_tokenizer(), max_tokens=4, overlap=4)
+
+
+def test_default_max_tokens():
+    chunker = PassageChunker(create_tokenizer())
+    assert chunker.max_tokens == 512 - chunker.tokenizer.num_special_tokens_to_add()
@@ -0,0 +1,46 @@
+"""Tests for `fotla.backend.corpus_loader`."""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fotla.backend.corpus_loader import ParquetCorpusLoader
+
+
+def write_corpus(path, num_docs, row_group_size):
+    table = pa.table(
+        {
+            "doc_id": list(range(num_docs)),
+            "title": [None if i % 3 == 0 else f"title {i}" for i in range(num_docs)],
+            "text": [None if i % 4 == 0 else f"text {i}" for i in range(num_docs)],
+            "extra": [i for i in range(num_docs)],
+        }
+    )
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+
+def test_load_batches_fills_nulls(tmp_path):
+    write_corpus(tmp_path / "corpus.parquet", 10, 4)
+    loader = ParquetCorpusLoader(str(tmp_path), verbose=False)
+    batches = list(loader.load_batches(batch_size=3))
+
+    assert all(set(batch.columns) == {"doc_id", "title", "text"} for batch in batches)
+    doc_ids = [doc_id for batch in batches for doc_id in batch.doc_ids]
+    assert doc_ids == [str(i) for i in range(10)]
+    titles = [title for batch in batches for title in batch.titles]
+    assert titles[0] == "" and titles[1] == "title 1"
+
+    docs = [doc for docs in loader.load(batch_size=3) for doc in docs]
+    assert docs[0].text == "" and docs[1].text == "text 1"
+
+
+def test_workers_split_row_groups(tmp_path):
+    write_corpus(tmp_path / "corpus.parquet", 10, 2)
+    doc_ids = []
+    for worker_id in range(3):
+        loader = ParquetCorpusLoader(
+            str(tmp_path), worker_id=worker_id, num_workers=3, verbose=False
+        )
+        doc_ids.extend(
+            doc_id for batch in loader.load_batches() for doc_id in batch.doc_ids
+        )
+    assert sorted(doc_ids, key=int) == [str(i) for i in range(10)]
@@ -0,0 +1,79 @@
+"""Tests for `fotla.backend.docstore`."""
+
+import threading
+
+from fotla.backend.corpus_loader import Doc, DocBatch
+from fotla.backend.docstore import OffsetDocStore
+
+
+def test_write_and_get_many(tmp_path):
+    store = OffsetDocStore(tmp_path)
+    docs = [
+        Doc(doc_id="a", title="title a", text="テキスト a"),
+        Doc(doc_id="b", title="title b", text="text b"),
+    ]
+    assert store.write(docs) == 2
+
+    fetched = store.get_many(["b", "missing", "a"])
+    assert fetched[0] == {"title": "title b", "text": "text b"}
+    assert fetched[1] is None
+    assert fetched[2] == {"title": "title a", "text": "テキスト a"}
+
+
+def test_write_batch_with_fields(tmp_path):
+    store = OffsetDocStore(tmp_path, fields=["title"])
+    batch = DocBatch(
+        {"doc_id": ["1", "2"], "title": ["one", "two"], "text": ["x", "y"]}
+    )
+    store.write_batch(batch)
+    assert store.get_many(["2", "1"]) == [{"title": "two"}, {"title": "one"}]
+
+
+def test_write_after_read_is_visible(tmp_path):
+    store = OffsetDocStore(tmp_path)
+    store.write([Doc(doc_id="a", title="", text="first")])
+    reader = store.open()
+    assert store.get_many(["a"]) == [{"title": "", "text": "first"}]
+
+    store.write([Doc(doc_id="b", title="", text="second")])
+    assert store.get_many(["b"]) == [{"title": "", "text": "second"}]
+    # the previous map is left open for the readers still using it
+    assert reader[0][:1] == b"{"
+
+
+def test_reopen_and_recreate(tmp_path):
+    OffsetDocStore(tmp_path).write([Doc(doc_id="a", title="", text="a")])
+    assert OffsetDocStore(tmp_path).get_many(["a"]) == [{"title": "", "text": "a"}]
+    assert OffsetDocStore(tmp_path, recreate=True).get_many(["a"]) == [None]
+
+
+def test_clear(tmp_path):
+    store = OffsetDocStore(tmp_path)
+    store.write([Doc(doc_id="a", title="", text="a")])
+    store.get_many(["a"])
+    store.clear()
+    assert store.get_many(["a"]) == [None]
+
+
+def test_concurrent_reads_and_writes(tmp_path):
+    store = OffsetDocStore(tmp_path)
+    store.write([Doc(doc_id="0", title="", text="0")])
+    errors = []
+
+    def read():
+        try:
+            for _ in range(200):
+                assert store.get_many(["0"]) == [{"title": "", "text": "0"}]
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for i in range(1, 100):
+        store.write([Doc(doc_id=str(i), title="", text=str(i))])
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    assert store.get_many(["99"]) == [{"title": "", "text": "99"}]
@@ -0,0 +1,198 @@
+"""Tests for `fotla.backend.indexer.elasticsearch`."""
+
+import numpy as np
+import pytest
+
+from fotla.backend.corpus_loader import Doc
+from fotla.backend.docstore import OffsetDocStore
+from fotla.backend.indexer import VecRecord
+from fotla.backend.indexer import elasticsearch as es_module
+from fotla.backend.indexer.elasticsearch import (
+    ElasticsearchConfig,
+    ElasticsearchIndexer,
+    prune_term_weights,
+)
+
+
+class FakeIndices(object):
+    def __init__(self):
+        self.names = set()
+
+    def exists(self, index):
+        return index in self.names
+
+    def create(self, index, body):
+        self.names.add(index)
+
+    def delete(self, index):
+        self.names.discard(index)
+
+
+class FakeElasticsearch(object):
+    """Records the search requests and answers them with `self.hits`."""
+
+    def __init__(self, *args, **kwargs):
+        self.indices = FakeIndices()
+        self.searches = []
+        self.options_calls = []
+        self.hits = []
+
+    def options(self, **kwargs):
+        self.options_calls.append(kwargs)
+        return self
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs)
+        hits = [dict(hit) for hit in self.hits]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+@pytest.fixture
+def fake_es(monkeypatch):
+    monkeypatch.setattr(es_module.elasticsearch, "Elasticsearch", FakeElasticsearch)
+
+
+def create_indexer(**kwargs):
+    return ElasticsearchIndexer(ElasticsearchConfig("localhost", 9200), **kwargs)
+
+
+def test_projection_always_excludes_vectors(fake_es):
+    indexer = create_indexer()
+    param = indexer.create_projection_param("vec")
+    assert param == {"source_excludes": ["vec", "sparse"]}
+
+    param = indexer.create_projection_param("passages.vec", source_excludes=["text"])
+    assert param == {"source_excludes": ["passages.vec", "sparse", "text"]}
+
+
+def test_projection_includes(fake_es):
+    param = create_indexer(fields=["doc_id", "title"]).create_projection_param("vec")
+    assert param["source_includes"] == ["doc_id", "title"]
+
+    param = create_indexer(fields=["doc_id", "title"]).create_projection_param(
+        "vec", source=["text"]
+    )
+    assert param["source_includes"] == ["text"]
+    assert param["source_excludes"] == ["vec", "sparse"]
+
+
+def test_projection_highlight(fake_es):
+    indexer = create_indexer()
+    param = indexer.create_projection_param("vec", highlight_fields=["text"])
+    assert param["highlight"] == {"fields": {"text": {}}}
+    assert param["source_excludes"] == ["vec", "sparse"]
+
+    param = indexer.create_projection_param(
+        "vec", highlight_fields=["text"], highlight_only=True
+    )
+    assert param == {"source": False, "highlight": {"fields": {"text": {}}}}
+
+    with pytest.raises(ValueError):
+        indexer.create_projection_param("vec", highlight_only=True)
+
+
+def test_projection_with_doc_store(fake_es, tmp_path):
+    indexer = create_indexer(doc_store=OffsetDocStore(tmp_path))
+    param = indexer.create_projection_param("vec", source=["title"])
+    assert param == {"source_includes": ["doc_id"]}
+
+
+def test_query_hydrates_from_doc_store(fake_es, tmp_path):
+    doc_store = OffsetDocStore(tmp_path)
+    doc_store.write([Doc(doc_id="a", title="title a", text="text a")])
+    indexer = create_indexer(doc_store=doc_store)
+    indexer.es.hits = [
+        {"_id": "1", "_score": 1.0, "_source": {"doc_id": "a"}},
+        {"_id": "2", "_score": 0.5, "_source": {"doc_id": "missing"}},
+    ]
+
+    [(_, result)] = indexer.query(
+        ["q"], term_fields=["text"], source_excludes=["text"]
+    )
+    assert result["hits"][0]["_source"] == {"doc_id": "a", "title": "title a"}
+    assert result["hits"][1]["_source"] == {"doc_id": "missing"}
+
+
+def test_recreate_index_clears_doc_store(fake_es, tmp_path):
+    doc_store = OffsetDocStore(tmp_path)
+    doc_store.write([Doc(doc_id="a", text="a")])
+    create_indexer(doc_store=doc_store, recreate_index=True)
+    assert doc_store.get_many(["a"]) == [None]
+
+
+def test_query_without_hydration(fake_es, tmp_path):
+    doc_store = OffsetDocStore(tmp_path)
+    doc_store.write([Doc(doc_id="a", title="title a", text="text a")])
+    indexer = create_indexer(doc_store=doc_store)
+    indexer.es.hits = [{"_id": "1", "_score": 1.0, "_source": {"doc_id": "a"}}]
+
+    [(_, result)] = indexer.query(["q"], term_fields=["text"], hydrate=False)
+    assert result["hits"][0]["_source"] == {"doc_id": "a"}
+
+    hits = indexer.hydrate_hits(result["hits"], source=["text"])
+    assert hits[0]["_source"] == {"doc_id": "a", "text": "text a"}
+    hits = [{"_id": "1", "_source": {"doc_id": "a"}}]
+    assert indexer.hydrate_hits(hits, highlight_only=True) == hits
+
+
+def test_prune_term_weights():
+    weights = {"a": 0.5, "b": 2.0, "c.d": 3.0, "": 1.0, "e": 0.0, "f": 1.0}
+    assert prune_term_weights(weights) == {"a": 0.5, "b": 2.0, "f": 1.0}
+    assert prune_term_weights(weights, max_terms=2) == {"b": 2.0, "f": 1.0}
+
+
+def test_create_index_body_with_sparse(fake_es):
+    record = VecRecord(
+        doc=Doc(doc_id="a", title="t", text="x"),
+        vec=np.array([3.0, 4.0]),
+        sparse={"x": 1.5, "y.z": 1.0, "w": 0.0},
+    )
+    body = create_indexer().create_index_body(record, None)
+    assert body["doc_id"] == "a"
+    np.testing.assert_allclose(body["vec"], [0.6, 0.8])
+    assert body["sparse"] == {"x": 1.5}
+
+
+def test_query_sparse_body(fake_es):
+    indexer = create_indexer()
+    indexer.query_sparse(
+        ["q1", "q2"],
+        [{"a": 2.0, "b": 1.0, "c": 0.5}, {"d": 1.0}],
+        max_query_terms=2,
+        term_fields=["title", "text"],
+        operator="or",
+        size=5,
+    )
+
+    first, second = indexer.es.searches
+    assert first["size"] == 5
+    assert first["query"]["bool"]["should"] == [
+        {"rank_feature": {"field": "sparse.a", "linear": {}, "boost": 2.0}},
+        {"rank_feature": {"field": "sparse.b", "linear": {}, "boost": 1.0}},
+        {
+            "multi_match": {
+                "query": "q1",
+                "fields": ["title", "text"],
+                "operator": "or",
+            }
+        },
+    ]
+    assert second["query"]["bool"]["should"][0]["rank_feature"]["field"] == "sparse.d"
+    assert first["source_excludes"] == ["vec", "sparse"]
+
+    with pytest.raises(ValueError):
+        indexer.query_sparse(["q"], [])
+
+
+def test_query_sparse_without_terms_returns_nothing(fake_es):
+    indexer = create_indexer()
+    indexer.es.hits = [{"_id": "1", "_score": 1.0, "_source": {}}]
+    [(query, result)] = indexer.query_sparse(["q"], [{"a.b": 1.0, "c": 0.0}])
+    assert (query, result) == ("q", {"total": 0, "hits": []})
+    assert indexer.es.searches == []
+
+    [(_, result)] = indexer.query_sparse(
+        ["q"], [{"a.b": 1.0}], term_fields=["text"]
+    )
+    assert result["total"] == 1
+    assert len(indexer.es.searches) == 1
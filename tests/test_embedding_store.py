@@ -0,0 +1,143 @@
+"""Tests for `fotla.backend.embedding_store`."""
+
+import json
+
+import numpy as np
+import pytest
+
+from fotla.backend.corpus_loader import Doc, DocBatch
+from fotla.backend.embedding_store import (
+    EmbeddingShardReader,
+    EmbeddingShardWriter,
+    import_embeddings,
+)
+
+
+def write_embeddings(path, num_docs, shard_size, write_size, dtype="float32"):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(num_docs, 4)).astype(np.float32)
+    doc_ids = [str(i) for i in range(num_docs)]
+    with EmbeddingShardWriter(path, shard_size=shard_size, dtype=dtype) as writer:
+        for start in range(0, num_docs, write_size):
+            end = start + write_size
+            writer.write(doc_ids[start:end], embeddings[start:end])
+    return doc_ids, embeddings
+
+
+class FakeIndexer(object):
+    """Records the records given to `async_index`."""
+
+    def __init__(self):
+        self.records = []
+
+    def async_index(self, records):
+        records = list(records)
+        self.records.extend(records)
+        return len(records)
+
+    def index_batch(self, batch, vectors=None):
+        raise AssertionError("import_embeddings must use async_index.")
+
+
+class FakeLoader(object):
+    def __init__(self, doc_ids):
+        self.docs = [Doc(doc_id=doc_id, text=f"text {doc_id}") for doc_id in doc_ids]
+
+    def load_batches(self, batch_size):
+        for start in range(0, len(self.docs), batch_size):
+            yield DocBatch.from_docs(self.docs[start : start + batch_size])
+
+
+def test_shards_are_cut_at_shard_size(tmp_path):
+    write_embeddings(tmp_path, 23, shard_size=10, write_size=7)
+    with open(tmp_path / "manifest.json") as f:
+        manifest = json.load(f)
+
+    assert manifest["complete"] is True
+    assert manifest["dim"] == 4
+    assert [shard["count"] for shard in manifest["shards"]] == [10, 10, 3]
+    assert np.load(tmp_path / "shard-00001.npy").shape == (10, 4)
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 10, 30])
+def test_round_trip_across_shards(tmp_path, batch_size):
+    doc_ids, embeddings = write_embeddings(tmp_path, 23, shard_size=10, write_size=7)
+    reader = EmbeddingShardReader(tmp_path)
+    assert len(reader) == 23
+
+    batches = list(reader.iter_batches(batch_size))
+    assert all(len(ids) == batch_size for ids, _ in batches[:-1])
+    assert [doc_id for ids, _ in batches for doc_id in ids] == doc_ids
+    read = np.concatenate([batch for _, batch in batches])
+    assert read.dtype == np.float32
+    np.testing.assert_array_equal(read, embeddings)
+
+
+def test_take_continues_over_shards(tmp_path):
+    doc_ids, embeddings = write_embeddings(
+        tmp_path, 12, shard_size=5, write_size=12, dtype="float16"
+    )
+    reader = EmbeddingShardReader(tmp_path)
+    first_ids, first = reader.take(7)
+    second_ids, second = reader.take(7)
+    assert first_ids == doc_ids[:7] and second_ids == doc_ids[7:]
+    np.testing.assert_allclose(np.concatenate([first, second]), embeddings, atol=1e-2)
+    assert reader.take(1)[1].shape == (0, 4)
+
+
+def test_failed_writer_is_marked_incomplete(tmp_path):
+    write_embeddings(tmp_path, 5, shard_size=10, write_size=5)
+    with pytest.raises(RuntimeError):
+        with EmbeddingShardWriter(tmp_path, shard_size=4) as writer:
+            writer.write(["0", "1", "2", "3", "4"], np.ones((5, 4)))
+            raise RuntimeError("encoding failed")
+
+    with open(tmp_path / "manifest.json") as f:
+        manifest = json.load(f)
+    assert manifest["complete"] is False
+    assert [shard["count"] for shard in manifest["shards"]] == [4]
+    with pytest.raises(ValueError):
+        EmbeddingShardReader(tmp_path)
+
+
+def test_write_validates_input(tmp_path):
+    with pytest.raises(ValueError):
+        EmbeddingShardWriter(tmp_path, dtype="int8")
+    with EmbeddingShardWriter(tmp_path) as writer:
+        with pytest.raises(ValueError):
+            writer.write(["0"], np.ones((2, 4)))
+
+
+def test_import_embeddings_with_corpus(tmp_path):
+    doc_ids, embeddings = write_embeddings(tmp_path, 12, shard_size=5, write_size=12)
+    indexer = FakeIndexer()
+    count = import_embeddings(
+        indexer, EmbeddingShardReader(tmp_path), FakeLoader(doc_ids), batch_size=5
+    )
+
+    assert count == 12
+    assert [record.doc.doc_id for record in indexer.records] == doc_ids
+    assert indexer.records[3].doc.text == "text 3"
+    np.testing.assert_array_equal(
+        np.stack([record.vec for record in indexer.records]), embeddings
+    )
+
+
+def test_import_embeddings_without_corpus(tmp_path):
+    doc_ids, _ = write_embeddings(tmp_path, 7, shard_size=5, write_size=7)
+    indexer = FakeIndexer()
+    count = import_embeddings(indexer, EmbeddingShardReader(tmp_path), batch_size=3)
+    assert count == 7
+    assert [record.doc.doc_id for record in indexer.records] == doc_ids
+
+
+def test_import_embeddings_rejects_mismatched_corpus(tmp_path):
+    doc_ids, _ = write_embeddings(tmp_path, 6, shard_size=5, write_size=6)
+    with pytest.raises(ValueError, match="does not match"):
+        import_embeddings(
+            FakeIndexer(), EmbeddingShardReader(tmp_path), FakeLoader(doc_ids[::-1])
+        )
+    with pytest.raises(ValueError, match="more documents"):
+        import_embeddings(
+            FakeIndexer(), EmbeddingShardReader(tmp_path), FakeLoader(doc_ids[:4])
+        )
@@ -0,0 +1,143 @@
+"""Tests for `fotla.backend.encoder`."""
+
+import numpy as np
+import pytest
+import torch
+from safetensors.torch import load_file, save_file
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import (
+    BertConfig,
+    BertForMaskedLM,
+    BertModel,
+    PreTrainedTokenizerFast,
+)
+
+from fotla.backend.encoder import (
+    HFMultiVectorEncoder,
+    HFSpladeEncoder,
+    load_checkpoint_tensor,
+)
+
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+SPECIAL_TOKENS += ["[unused0]", "[unused1]"]
+WORDS = [".", ",", "!"] + [f"w{i}" for i in range(20)]
+
+
+def save_tokenizer(path):
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])],
+    )
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        unk_token="[UNK]",
+        pad_token="[PAD]",
+        cls_token="[CLS]",
+        sep_token="[SEP]",
+        mask_token="[MASK]",
+    ).save_pretrained(path)
+    return vocab
+
+
+def create_config():
+    return BertConfig(
+        vocab_size=len(SPECIAL_TOKENS + WORDS),
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+    )
+
+
+def save_model(path, projection_dim=None):
+    torch.manual_seed(0)
+    BertModel(create_config()).save_pretrained(path)
+    if projection_dim is not None:
+        weights_path = path / "model.safetensors"
+        state_dict = load_file(weights_path)
+        state_dict["linear.weight"] = torch.randn(projection_dim, 16)
+        save_file(state_dict, weights_path, metadata={"format": "pt"})
+
+
+@pytest.fixture
+def colbert_path(tmp_path):
+    save_tokenizer(tmp_path)
+    save_model(tmp_path, projection_dim=8)
+    return tmp_path
+
+
+def test_load_checkpoint_tensor(colbert_path, tmp_path_factory):
+    assert load_checkpoint_tensor(str(colbert_path), "linear.weight").shape == (8, 16)
+    assert load_checkpoint_tensor(str(colbert_path), "missing") is None
+    empty = tmp_path_factory.mktemp("empty")
+    assert load_checkpoint_tensor(str(empty), "linear.weight") is None
+
+
+def test_plain_encoder_keeps_hidden_states(tmp_path):
+    save_tokenizer(tmp_path)
+    save_model(tmp_path)
+    encoder = HFMultiVectorEncoder(str(tmp_path), verbose=False, device="cpu")
+    assert encoder.projection is None
+
+    [doc, short] = encoder.encode_corpus(["w1 . w2", "w3"])
+    assert doc.shape == (5, 16) and short.shape == (3, 16)
+    np.testing.assert_allclose(np.linalg.norm(doc, axis=1), 1.0, rtol=1e-5)
+
+
+def test_colbert_input_format(colbert_path):
+    encoder = HFMultiVectorEncoder.from_colbert(
+        str(colbert_path), verbose=False, device="cpu", query_maxlen=8
+    )
+    vocab = encoder.tokenizer.get_vocab()
+
+    inputs = encoder.tokenize(["w1 w2"], 8, "[unused0]", augment=True)
+    assert inputs["input_ids"][0].tolist() == [
+        vocab[token]
+        for token in ["[CLS]", "[unused0]", "w1", "w2", "[SEP]"] + ["[MASK]"] * 3
+    ]
+    assert inputs["attention_mask"][0].tolist() == [1] * 5 + [0] * 3
+
+    [query] = encoder.encode_queries(["w1 w2"])
+    assert query.shape == (8, 8)
+
+    # [CLS] [unused1] w1 w2 [SEP], without the punctuation
+    [doc] = encoder.encode_corpus(["w1 . w2 !"])
+    assert doc.shape == (5, 8)
+
+
+def test_projection_is_applied(colbert_path):
+    encoder = HFMultiVectorEncoder(str(colbert_path), verbose=False, device="cpu")
+    [doc] = encoder.encode_corpus(["w1 w2"])
+
+    inputs = encoder.tokenize(["w1 w2"], 180, None, augment=False)
+    with torch.no_grad():
+        hidden_states = encoder.model(**inputs)[0][0]
+    weight = load_checkpoint_tensor(str(colbert_path), "linear.weight")
+    expected = torch.nn.functional.normalize(hidden_states @ weight.T, dim=-1)
+    np.testing.assert_allclose(doc, expected.numpy(), atol=1e-5)
+
+
+def test_splade_encoder_keeps_topk_terms(tmp_path):
+    vocab = save_tokenizer(tmp_path)
+    torch.manual_seed(0)
+    BertForMaskedLM(create_config()).save_pretrained(tmp_path)
+    encoder = HFSpladeEncoder(
+        str(tmp_path), verbose=False, device="cpu", doc_topk=5, query_topk=2
+    )
+
+    docs = encoder.encode_corpus(["w1 w2 w3", "w4"])
+    [query] = encoder.encode_queries(["w1 w2 w3"])
+    assert len(docs) == 2
+    assert all(0 < len(weights) <= 5 for weights in docs)
+    assert 0 < len(query) <= 2
+    assert all(term in vocab for weights in docs for term in weights)
+    assert all(weight > 0 for weights in docs for weight in weights.values())
+
+    # the query terms are the heaviest terms of the same text
+    heaviest = sorted(docs[0], key=docs[0].get, reverse=True)[: len(query)]
+    assert list(query) == heaviest
+    for term, weight in query.items():
+        assert weight == pytest.approx(docs[0][term])
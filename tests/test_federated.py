@@ -0,0 +1,162 @@
+"""Tests for `fotla.backend.indexer.federated`."""
+
+import threading
+
+import pytest
+
+from fotla.backend.indexer import DenseIndexer, FederatedIndexer
+from fotla.backend.indexer.federated import normalize_scores
+
+
+class FakeShard(DenseIndexer):
+    def __init__(self, scores, delay=0.0, release=None):
+        self.scores = scores
+        self.delay = delay
+        self.release = release
+        self.calls = []
+        self.hydrated = []
+
+    def index(self, records):
+        return 0
+
+    def query(self, queries, **kwargs):
+        self.calls.append(kwargs)
+        if self.release is not None:
+            self.release.wait(self.delay)
+        hits = [
+            {"_id": f"{id(self)}-{i}", "_score": score}
+            for i, score in enumerate(self.scores[: kwargs["size"]])
+        ]
+        result = {"total": len(self.scores), "hits": hits}
+        return [(query, result) for query in queries]
+
+    def query_sparse(self, queries, term_weights, **kwargs):
+        return self.query(queries, term_weights=term_weights, **kwargs)
+
+    def hydrate_hits(self, hits, source=None, *args):
+        self.hydrated.extend(hit["_id"] for hit in hits)
+        for hit in hits:
+            hit["_source"] = {"source": source}
+        return hits
+
+
+def test_normalize_scores_minmax():
+    hits = [{"_score": 3.0}, {"_score": 2.0}, {"_score": 1.0}]
+    normalize_scores(hits, "minmax")
+    assert [hit["_score"] for hit in hits] == [1.0, 0.5, 0.0]
+    assert [hit["_raw_score"] for hit in hits] == [3.0, 2.0, 1.0]
+
+
+def test_normalize_scores_zscore():
+    hits = [{"_score": 3.0}, {"_score": 1.0}]
+    normalize_scores(hits, "zscore")
+    assert [hit["_score"] for hit in hits] == [1.0, -1.0]
+
+
+def test_normalize_scores_constant():
+    hits = [{"_score": 2.0}, {"_score": 2.0}]
+    assert [hit["_score"] for hit in normalize_scores(hits, "minmax")] == [1.0, 1.0]
+    assert [hit["_score"] for hit in normalize_scores(hits, "zscore")] == [0.0, 0.0]
+
+
+def test_normalize_scores_none():
+    hits = [{"_score": 2.0}]
+    assert normalize_scores(hits, None) == [{"_score": 2.0}]
+    with pytest.raises(ValueError):
+        normalize_scores([{"_score": 1.0}], "rank")
+
+
+def test_query_merges_shards():
+    shards = {"a": FakeShard([10.0, 5.0, 0.0]), "b": FakeShard([0.4, 0.3, 0.2])}
+    indexer = FederatedIndexer(shards, timeout=5.0)
+    [(_, result)] = indexer.query(["q"], term_fields=["text"], top_k=3, size=2)
+
+    assert result["total"] == 6
+    assert result["partial"] is False
+    assert [hit["_score"] for hit in result["hits"]] == [1.0, 1.0]
+    assert {hit["_shard"] for hit in result["hits"]} == {"a", "b"}
+    for shard in shards.values():
+        assert shard.calls[0]["size"] == 3
+        assert shard.calls[0]["request_timeout"] == 5.0
+
+
+def test_query_window_is_fixed_within_top_k():
+    shards = {"a": FakeShard([4.0, 3.0, 2.0, 1.0]), "b": FakeShard([1.0, 0.0])}
+    indexer = FederatedIndexer(shards, timeout=5.0)
+    [(_, first)] = indexer.query(["q"], term_fields=["text"], top_k=4, size=2)
+    [(_, second)] = indexer.query(
+        ["q"], term_fields=["text"], top_k=4, from_=2, size=2
+    )
+    [(_, whole)] = indexer.query(["q"], term_fields=["text"], top_k=4, size=4)
+    assert first["hits"] + second["hits"] == whole["hits"]
+
+
+def test_query_times_out_slow_shard():
+    release = threading.Event()
+    shards = {"fast": FakeShard([1.0]), "slow": FakeShard([1.0], 5.0, release)}
+    indexer = FederatedIndexer(shards, timeout=5.0, shard_timeouts={"slow": 0.05})
+    try:
+        [(_, result)] = indexer.query(["q"], term_fields=["text"])
+    finally:
+        release.set()
+
+    assert result["partial"] is True
+    assert result["shards"]["timed_out"] == ["slow"]
+    assert shards["slow"].calls[0]["request_timeout"] == 0.05
+
+
+def test_query_skips_saturated_shard():
+    release = threading.Event()
+    shards = {"fast": FakeShard([1.0]), "slow": FakeShard([1.0], 5.0, release)}
+    indexer = FederatedIndexer(
+        shards, timeout=5.0, shard_timeouts={"slow": 0.01}, max_in_flight=1
+    )
+    try:
+        indexer.query(["q"], term_fields=["text"])
+        [(_, result)] = indexer.query(["q"], term_fields=["text"])
+    finally:
+        release.set()
+
+    assert result["shards"]["skipped"] == ["slow"]
+    assert result["shards"]["successful"] == 1
+    assert len(shards["slow"].calls) == 1
+
+
+def test_failed_shard_is_reported():
+    shards = {"a": FakeShard([1.0]), "b": FakeShard(None)}
+    indexer = FederatedIndexer(shards, timeout=5.0)
+    [(_, result)] = indexer.query(["q"], term_fields=["text"])
+    assert result["shards"]["failed"] == ["b"]
+    assert [hit["_shard"] for hit in result["hits"]] == ["a"]
+
+
+def test_query_hydrates_only_returned_hits():
+    shards = {"a": FakeShard([3.0, 2.0, 1.0, 0.0]), "b": FakeShard([1.0, 0.5, 0.0])}
+    indexer = FederatedIndexer(shards, timeout=5.0)
+    [(_, result)] = indexer.query(
+        ["q"], term_fields=["text"], top_k=4, from_=1, size=2, source=["title"]
+    )
+
+    assert all(shard.calls[0]["hydrate"] is False for shard in shards.values())
+    hydrated = shards["a"].hydrated + shards["b"].hydrated
+    assert sorted(hydrated) == sorted(hit["_id"] for hit in result["hits"])
+    assert all(hit["_source"] == {"source": ["title"]} for hit in result["hits"])
+
+    indexer.query(["q"], term_fields=["text"], hydrate=False)
+    assert len(shards["a"].hydrated + shards["b"].hydrated) == 2
+
+
+def test_query_sparse_fans_out():
+    shards = {"a": FakeShard([2.0, 1.0]), "b": FakeShard([4.0, 3.0, 0.0])}
+    indexer = FederatedIndexer(shards, timeout=5.0)
+    [(_, result)] = indexer.query_sparse(
+        ["q"], [{"t": 1.0}], max_query_terms=8, top_k=3, size=3
+    )
+
+    assert result["total"] == 5
+    assert result["shards"]["successful"] == 2
+    assert len(result["hits"]) == 3
+    for shard in shards.values():
+        assert shard.calls[0]["term_weights"] == [{"t": 1.0}]
+        assert shard.calls[0]["max_query_terms"] == 8
+        assert shard.calls[0]["hydrate"] is False
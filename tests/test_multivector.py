@@ -0,0 +1,139 @@
+"""Tests for `fotla.backend.indexer.multivector`."""
+
+import numpy as np
+import pytest
+
+from fotla.backend.corpus_loader import Doc, DocBatch
+from fotla.backend.indexer.multivector import MultiVectorIndexer, quantize
+
+
+def random_tokens(rng, num_tokens, dim=16):
+    tokens = rng.normal(size=(num_tokens, dim)).astype(np.float32)
+    return tokens / np.linalg.norm(tokens, axis=1, keepdims=True)
+
+
+def exact_maxsim(query, docs):
+    return np.array([(query @ doc.T).max(axis=1).sum() for doc in docs])
+
+
+def build_index(path, docs, **kwargs):
+    indexer = MultiVectorIndexer(path, recreate=True, **kwargs)
+    doc_ids = [f"d{i}" for i in range(len(docs))]
+    indexer.add(doc_ids[:20], docs[:20])
+    indexer.add(doc_ids[20:], docs[20:])
+    indexer.build(num_centroids=8, seed=0)
+    return indexer
+
+
+class FakeLoader(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def load_batches(self, batch_size):
+        yield DocBatch.from_docs(self.docs)
+
+
+def test_quantize_round_trip():
+    rng = np.random.default_rng(0)
+    tokens = random_tokens(rng, 100)
+    codes, scales = quantize(tokens)
+    assert codes.dtype == np.int8
+    np.testing.assert_allclose(codes * scales[:, None], tokens, atol=0.01)
+
+
+def test_search_matches_exact_maxsim(tmp_path):
+    rng = np.random.default_rng(0)
+    docs = [random_tokens(rng, n) for n in rng.integers(1, 30, size=50)]
+    indexer = build_index(tmp_path, docs, nprobe=8, rescore_chunk_size=7)
+
+    for _ in range(5):
+        query = random_tokens(rng, 8)
+        doc_ids, scores, total = indexer.search(query, top_k=10)
+
+        exact = exact_maxsim(query, docs)
+        expected = np.argsort(-exact)[:10]
+        assert total == len(docs)
+        assert doc_ids[:3] == [f"d{i}" for i in expected[:3]]
+        np.testing.assert_allclose(scores, exact[expected], atol=0.05)
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_search_limits_candidates(tmp_path):
+    rng = np.random.default_rng(1)
+    docs = [random_tokens(rng, 10) for _ in range(50)]
+    indexer = build_index(tmp_path, docs, nprobe=1, candidate_size=5)
+
+    doc_ids, scores, total = indexer.search(random_tokens(rng, 4), top_k=10)
+    assert total <= 5
+    assert len(doc_ids) == len(scores) == total
+
+
+def test_add_validates_input(tmp_path):
+    indexer = MultiVectorIndexer(tmp_path)
+    with pytest.raises(ValueError):
+        indexer.add(["a"], [])
+    with pytest.raises(ValueError):
+        indexer.add(["a"], [np.empty((0, 4), dtype=np.float32)])
+
+
+def test_late_interaction_retriever_pages(tmp_path):
+    from fotla.backend.encoder import MultiVectorEncoder
+    from fotla.backend.retriever import LateInteractionRetriever
+
+    rng = np.random.default_rng(2)
+    docs = {f"d{i}": random_tokens(rng, 5) for i in range(30)}
+
+    class FakeEncoder(MultiVectorEncoder):
+        def encode_corpus(self, texts):
+            return [docs[text] for text in texts]
+
+        def encode_queries(self, queries):
+            return [docs[query][:2] for query in queries]
+
+    indexer = MultiVectorIndexer(tmp_path, nprobe=8, recreate=True)
+    retriever = LateInteractionRetriever(
+        FakeEncoder(), indexer, batch_to_texts=lambda batch: batch.doc_ids
+    )
+    retriever.index(FakeLoader([Doc(doc_id=doc_id, text="") for doc_id in docs]))
+
+    [(_, first)] = retriever.retrieve(["d3"], top_k=10, size=4)
+    [(_, second)] = retriever.retrieve(["d3"], top_k=10, from_=4, size=4)
+    [(_, whole)] = retriever.retrieve(["d3"], top_k=10, size=8)
+    assert first["hits"][0]["_id"] == "d3"
+    assert len(first["hits"]) == 4
+    assert first["hits"] + second["hits"] == whole["hits"]
+    assert len(whole["hits"]) <= first["total"] <= len(docs)
+
+    with pytest.raises(ValueError):
+        retriever.retrieve(["d3"], top_k=10, highlight_fields=["text"])
+
+
+def test_build_memory_is_bounded(tmp_path):
+    tracemalloc = pytest.importorskip("tracemalloc")
+    rng = np.random.default_rng(3)
+    docs = [random_tokens(rng, 50) for _ in range(100)]
+    indexer = MultiVectorIndexer(tmp_path, recreate=True)
+    indexer.add([f"d{i}" for i in range(len(docs))], docs)
+
+    # 5,000 tokens x 4,096 centroids would be an 80 MB similarity matrix
+    tracemalloc.start()
+    try:
+        indexer.build(num_centroids=4096, iterations=2, max_block_bytes=2**20)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 * 2**20
+
+    doc_ids, _, _ = indexer.search(docs[7][:4], top_k=1)
+    assert doc_ids == ["d7"]
+
+
+def test_assign_centroids_in_blocks():
+    from fotla.backend.indexer.multivector import assign_centroids
+
+    rng = np.random.default_rng(4)
+    embeddings, centroids = random_tokens(rng, 100), random_tokens(rng, 7)
+    expected = np.argmax(embeddings @ centroids.T, axis=1)
+    np.testing.assert_array_equal(
+        assign_centroids(embeddings, centroids, max_block_bytes=4 * 7 * 3), expected
+    )
@@ -0,0 +1,121 @@
+"""Tests for `fotla.backend.retriever.PassageDenseRetriever`."""
+
+import numpy as np
+import pytest
+
+from fotla.backend.corpus_loader import Doc
+from fotla.backend.encoder import DenseEncoder
+from fotla.backend.indexer import DenseIndexer
+from fotla.backend.retriever import PassageDenseRetriever
+
+
+class FakeEncoder(DenseEncoder):
+    def encode_corpus(self, texts):
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+class FakeChunker(object):
+    def chunk(self, texts):
+        passages, parents = [], []
+        for i, text in enumerate(texts):
+            for passage in text.split("|"):
+                passages.append(passage)
+                parents.append(i)
+        return passages, parents
+
+
+class FakeIndexer(DenseIndexer):
+    def __init__(self, hits=()):
+        self.records = []
+        self.async_records = []
+        self.hits = list(hits)
+        self.calls = []
+        self.hydrated = []
+
+    def index(self, records):
+        self.records.extend(records)
+        return len(self.records)
+
+    def async_index(self, records):
+        self.async_records.extend(records)
+        return len(self.async_records)
+
+    def query(self, queries, **kwargs):
+        self.calls.append(kwargs)
+        hits = [dict(hit) for hit in self.hits]
+        return [(query, {"total": len(hits), "hits": hits}) for query in queries]
+
+    def hydrate_hits(self, hits, source=None, source_excludes=None, *args):
+        self.hydrated.append((hits, source_excludes))
+        return hits
+
+
+class FakeLoader(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def load(self, batch_size):
+        yield self.docs
+
+
+def create_retriever(indexer, aggregation="max"):
+    return PassageDenseRetriever(
+        FakeEncoder(),
+        indexer,
+        FakeChunker(),
+        aggregation=aggregation,
+        model_to_texts=lambda docs: [doc.text for doc in docs],
+    )
+
+
+@pytest.mark.parametrize("method", ["index", "async_index"])
+def test_index_chunks_documents(method):
+    indexer = FakeIndexer()
+    retriever = create_retriever(indexer)
+    docs = [Doc(doc_id="a", text="x|yyyy|zz"), Doc(doc_id="b", text="long text")]
+    getattr(retriever, method)(FakeLoader(docs))
+
+    records = indexer.records if method == "index" else indexer.async_records
+    assert [record.doc.doc_id for record in records] == ["a", "b"]
+    assert records[0].vec[:, 0].tolist() == [1.0, 4.0, 2.0]
+    assert records[1].vec[:, 0].tolist() == [9.0]
+
+
+def test_aggregate_topk_sum_keeps_term_score():
+    def passages(*scores):
+        hits = [{"_score": score} for score in scores]
+        return {"passages": {"hits": {"hits": hits}}}
+
+    hits = [
+        # 2.0 from the term query and 0.9 from the best passage
+        {"_id": "a", "_score": 2.9, "inner_hits": passages(0.9, 0.1)},
+        {"_id": "b", "_score": 2.8, "inner_hits": passages(0.8, 0.7, 0.6)},
+        {"_id": "c", "_score": 2.5},
+    ]
+    retriever = create_retriever(FakeIndexer())
+    aggregated = retriever.aggregate_topk_sum(hits)
+
+    assert [hit["_id"] for hit in aggregated] == ["b", "a", "c"]
+    assert [hit["_score"] for hit in aggregated] == pytest.approx([4.1, 3.0, 2.5])
+
+
+def test_topk_sum_hydrates_only_the_page():
+    def passages(*scores):
+        return {"passages": {"hits": {"hits": [{"_score": s} for s in scores]}}}
+
+    hits = [
+        {"_id": str(i), "_score": 1.0, "inner_hits": passages(1.0, i / 10)}
+        for i in range(6)
+    ]
+    indexer = FakeIndexer(hits)
+    retriever = create_retriever(indexer, aggregation="topk_sum")
+    retriever.encode_queries = lambda queries: [np.ones(2) for _ in queries]
+    [(_, result)] = retriever.retrieve(["q"], top_k=6, from_=1, size=2)
+
+    assert indexer.calls[0]["hydrate"] is False
+    assert indexer.calls[0]["size"] == 6
+    assert [hit["_id"] for hit in result["hits"]] == ["4", "3"]
+    assert all("inner_hits" not in hit for hit in result["hits"])
+    [(hydrated, source_excludes)] = indexer.hydrated
+    assert hydrated == result["hits"]
+    assert source_excludes == ["passages"]